@@ -0,0 +1,160 @@
+"""Step response summary of every run in data/.
+
+    python3 analytics.py                       # scan ../data, print the table
+    python3 analytics.py --axis y --sort settling_time
+    python3 analytics.py --force               # recompute every file
+
+Each run log (.csv as written by controllers.PID.log(), or .run, see runlog)
+is split by its axis column and every axis gets one row of metrics
+(metrics.step_metrics, last-entry settling). Files are analysed in parallel
+and the rows are kept in one summary table (data/summary.csv by default)
+together with each file's size and modification time, so the next scan only
+recomputes the files that changed. Files without a usable axis, or that could
+not be read, keep one row with an empty axis (and the error, if any), so they
+are not parsed again either.
+"""
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import metrics
+import runlog
+
+SUMMARY_COLUMNS = ("file", "axis", "samples", "missing", "duration", "x0", "setpoint",
+                   "kp", "ki", "kd") + metrics.METRICS + ("mtime_ns", "size", "error")
+TEXT_COLUMNS = ("file", "axis", "error")
+INT_COLUMNS = ("samples", "missing", "mtime_ns", "size")
+
+
+def _axis_rows(records):
+    # records: RECORD_DTYPE array of one file -> one summary row per axis
+    rows = []
+    for name in np.unique(records["axis"]):
+        r = records[records["axis"] == name]
+        r = r[np.argsort(r["time"], kind="stable")]
+        found = r["pos"] != 0          # 0 means the tracker found nothing
+        if found.sum() < 2:
+            continue
+        t, pos, control = r["time"][found], r["pos"][found], r["ctrl_out"][found]
+        last = r[-1]
+        row = {"axis": name.decode(), "samples": int(found.sum()), "missing": int((~found).sum()),
+               "duration": float(t[-1] - t[0]), "x0": float(pos[0]), "setpoint": float(last["setpoint"]),
+               "kp": float(last["kp"]), "ki": float(last["ki"]), "kd": float(last["kd"])}
+        row.update(metrics.step_metrics(t, pos, control, last["setpoint"]))
+        rows.append(row)
+    return rows
+
+
+def _file_info(path):
+    stat = os.stat(path)
+    return {"file": os.path.basename(path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def analyze_file(path):
+    """Summary rows (dicts) for one run log."""
+    records = runlog.Run(path).records() if path.endswith(".run") else runlog.read_csv(path)
+    info = _file_info(path)
+    return [dict(row, error="", **info) for row in _axis_rows(records)]
+
+
+def _analyze(path):
+    # Process pool worker: never raises, so one bad file doesn't stop the scan.
+    # A file without rows gets a placeholder row (empty axis) for the cache
+    try:
+        rows, error = analyze_file(path), None
+    except (ValueError, IndexError, KeyError, OSError) as e:
+        rows, error = [], str(e)
+    if not rows:
+        try:
+            rows = [dict(_file_info(path), axis="", error=error or "")]
+        except OSError:
+            pass
+    return path, rows, error
+
+
+def read_summary(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for name in SUMMARY_COLUMNS:
+            value = row.get(name) or ""
+            if name in TEXT_COLUMNS:
+                row[name] = value
+            elif name in INT_COLUMNS:
+                row[name] = int(value) if value else 0
+            else:
+                row[name] = float(value) if value else float("nan")
+    return rows
+
+
+def write_summary(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def scan(directory="../data", summary=None, workers=None, force=False):
+    """Summary rows of every run in directory, reusing the summary table for
+    files whose size and mtime did not change. Returns (rows, errors), errors
+    being {file name: message} of the files that could not be analysed."""
+    summary = summary or os.path.join(directory, "summary.csv")
+    paths = sorted(p for p in glob.glob(os.path.join(directory, "*.csv")) + glob.glob(os.path.join(directory, "*.run"))
+                   if os.path.abspath(p) != os.path.abspath(summary))
+
+    cached = {}
+    if not force:
+        for row in read_summary(summary):
+            cached.setdefault(row["file"], []).append(row)
+
+    rows, stale = [], []
+    for path in paths:
+        stat = os.stat(path)
+        previous = cached.get(os.path.basename(path))
+        if previous and previous[0]["mtime_ns"] == stat.st_mtime_ns and previous[0]["size"] == stat.st_size:
+            rows.extend(previous)
+        else:
+            stale.append(path)
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for _, new_rows, _ in pool.map(_analyze, stale):
+                rows.extend(new_rows)
+
+    rows.sort(key=lambda r: (r["file"], r["axis"]))
+    write_summary(summary, rows)
+    errors = {r["file"]: r["error"] for r in rows if r["error"]}
+    return [r for r in rows if r["axis"]], errors
+
+
+def print_table(rows):
+    print(f"{'file':<30} {'axis':<4} {'kp':>6} {'ki':>7} {'kd':>6} {'Ts [s]':>7} {'OS [%]':>7} "
+          f"{'Ess':>6} {'Tp [s]':>7} {'effort':>7}")
+    for r in rows:
+        print(f"{r['file']:<30} {r['axis']:<4} {r['kp']:6.2f} {r['ki']:7.3f} {r['kd']:6.3f} "
+              f"{r['settling_time']:7.2f} {r['overshoot']:7.1f} {r['ess']:6.1f} {r['peak_time']:7.2f} "
+              f"{r['effort']:7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Step response metrics for every run in a directory")
+    parser.add_argument("directory", nargs="?", default="../data")
+    parser.add_argument("--summary", help="summary table (default: <directory>/summary.csv)")
+    parser.add_argument("--axis", help="only show this axis")
+    parser.add_argument("--sort", default="file", choices=SUMMARY_COLUMNS)
+    parser.add_argument("--workers", type=int, default=None, help="default: all cores")
+    parser.add_argument("--force", action="store_true", help="ignore the cached summary")
+    args = parser.parse_args()
+
+    rows, errors = scan(args.directory, args.summary, args.workers, args.force)
+    if args.axis:
+        rows = [r for r in rows if r["axis"] == args.axis]
+    # NaN (never settled) sorts last
+    rows.sort(key=lambda r: (r[args.sort] != r[args.sort], r[args.sort]))
+    print_table(rows)
+    for name, error in errors.items():
+        print(f"skipped {name}: {error}")
@@ -0,0 +1,262 @@
+"""Micro-benchmark for image_processing on synthetic frames.
+
+    python3 bench_vision.py                          # full grid, JSON to ../data
+    python3 bench_vision.py --sizes 640 --frames 100
+    python3 bench_vision.py --compare ../data/<old>_bench_vision.json
+
+Each case is a frame size, an ROI size (fraction of the frame side), a
+clutter level (number of distractor blobs) and a noise level (Gaussian sigma).
+Frames show a dark agent on a lit, slightly uneven background and the agent
+moves along a circle, so the windowed tracker sees realistic motion.
+
+For every case the one-shot ip.mask(), the reusable MaskPipeline (full frame
+and cropped), the individual OpenCV calls inside the pipeline, both track()
+backends (and track_blob() with a reused label buffer) and the WindowTracker
+(with ip.TRACK_BACKEND) are timed call by call. Timing and allocation
+runs are separate: allocations are measured with tracemalloc (which also sees
+numpy buffers) as the peak and retained bytes and the number of memory blocks
+allocated (and still held) per call. Each case also checks,
+for both backends, that the WindowTracker finds the same centroid as a
+whole-ROI search of the same frame.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import image_processing as ip
+
+
+# ---------------- Synthetic frames ----------------
+def make_case(size, roi, clutter, noise, n_frames, seed=0):
+    """Frames, ROI corners and the agent's radius for one case."""
+    rng = np.random.default_rng(seed)
+    radius = max(4, int(0.03 * size))
+
+    # Centred square ROI, corners in the same order as main.py
+    half = int(roi * size / 2)
+    c = size // 2
+    x0, y0, x1, y1 = max(0, c - half), max(0, c - half), min(size - 1, c + half), min(size - 1, c + half)
+    roi_points = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+    # Lit background with a gentle gradient (the coils' lighting is not flat)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    shade = 190 + 40 * (xx + yy) / (2 * size)
+    background = np.repeat(shade[:, :, None], 3, axis=2)
+
+    # Distractors: small dark specks (pass the threshold, fail min_area) and
+    # larger coloured blobs (fail the threshold)
+    for _ in range(clutter):
+        x, y = rng.integers(0, size, 2)
+        if rng.random() < 0.5:
+            cv2.circle(background, (int(x), int(y)), max(1, radius // 4), (30, 30, 30), -1)
+        else:
+            colour = rng.integers(60, 255, 3)
+            colour[rng.integers(3)] = rng.integers(150, 255)   # bright enough to fail UPPER_BLACK
+            colour = tuple(float(v) for v in colour)
+            cv2.circle(background, (int(x), int(y)), int(rng.integers(radius // 2, 2 * radius)), colour, -1)
+
+    # Agent path: a circle inside the ROI
+    path_r = max(1, half - 2 * radius)
+    frames = np.empty((n_frames, size, size, 3), dtype=np.uint8)
+    for i in range(n_frames):
+        a = 2 * np.pi * i / n_frames
+        frame = background.copy()
+        cv2.circle(frame, (int(c + path_r * np.cos(a)), int(c + path_r * np.sin(a))), radius, (20, 20, 20), -1)
+        if noise > 0:
+            frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+        np.clip(frame, 0, 255, out=frame)
+        frames[i] = frame
+    return frames, roi_points, radius
+
+
+# ---------------- Measurement ----------------
+def time_calls(fn, inputs, repeat, warmup=3):
+    """Per-call durations [ns] of fn(x), cycling through inputs."""
+    for x in itertools.islice(itertools.cycle(inputs), warmup):
+        fn(x)
+    durations = np.empty(repeat, dtype=np.int64)
+    for i, x in enumerate(itertools.islice(itertools.cycle(inputs), repeat)):
+        t0 = time.perf_counter_ns()
+        fn(x)
+        durations[i] = time.perf_counter_ns() - t0
+    return durations
+
+
+def _traced(snapshot):
+    # Leave out tracemalloc's own bookkeeping
+    return snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+def alloc_per_call(fn, inputs, calls=10, baseline=True):
+    # (peak bytes, retained bytes, retained blocks) per call, after one warm-up call;
+    # blocks count the allocations still held (snapshot count diff, less what the
+    # measuring loop holds itself): tracemalloc can't count blocks freed again
+    # within the call, the peak covers those
+    overhead = alloc_per_call(lambda x: None, inputs, calls, baseline=False)[2] if baseline else 0.0
+    fn(inputs[0])
+    tracemalloc.start()
+    try:
+        start = _traced(tracemalloc.take_snapshot())
+        base, _ = tracemalloc.get_traced_memory()
+        peak = 0
+        for x in itertools.islice(itertools.cycle(inputs), calls):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            fn(x)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        retained = tracemalloc.get_traced_memory()[0] - base
+        blocks = sum(stat.count_diff for stat in _traced(tracemalloc.take_snapshot()).compare_to(start, "traceback"))
+    finally:
+        tracemalloc.stop()
+    return peak, retained / calls, max(0.0, blocks / calls - overhead)
+
+
+def window_drift(frames, roi_points, min_area, window, backend):
+    """Largest distance [px] between the WindowTracker's centroid and that of
+    a whole-ROI search of the same frame (should be ~0: the window must not
+    change what is found), and the frames where only one of them found it."""
+    tracker = ip.WindowTracker(ip.MaskPipeline(roi_points, crop=True), min_area, window=window, backend=backend)
+    full = ip.WindowTracker(ip.MaskPipeline(roi_points, crop=True), min_area, window=window, backend=backend)
+    drift, mismatches = 0.0, 0
+    for frame in frames:
+        found = tracker(frame) is not None
+        full.reset()                  # no history: always the whole ROI
+        if (full(frame) is not None) != found:
+            mismatches += 1
+        elif found:
+            drift = max(drift, float(np.hypot(tracker.centroid[0] - full.centroid[0],
+                                              tracker.centroid[1] - full.centroid[1])))
+    return drift, mismatches
+
+
+def summarize(durations, alloc):
+    ms = durations / 1e6
+    mean = float(ms.mean())
+    return {"mean_ms": mean, "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max()),
+            "fps": 1000.0 / mean if mean > 0 else None,
+            "peak_alloc_bytes": int(alloc[0]), "retained_bytes": float(alloc[1]),
+            "alloc_blocks": float(alloc[2])}
+
+
+def pipeline_stages(pipeline, frame):
+    """The OpenCV calls of MaskPipeline.apply() (cropped), as separate stages.
+    Each stage takes the frame and reads the previous stage's buffer."""
+    pipeline(frame)     # configure the buffers
+    x, y, w, h = pipeline.roi_rect
+    hsv, thresh, out = pipeline._hsv[:h, :w], pipeline._thresh[:h, :w], pipeline._mask[:h, :w]
+    roi = pipeline.roi_mask[y:y + h, x:x + w]
+    return {
+        "cvtColor": lambda f: cv2.cvtColor(f[y:y + h, x:x + w], cv2.COLOR_BGR2HSV, dst=hsv),
+        "inRange": lambda f: cv2.inRange(hsv, pipeline.lower, pipeline.upper, dst=thresh),
+        "roi_and": lambda f: cv2.bitwise_and(thresh, roi, dst=thresh),
+        "open": lambda f: cv2.morphologyEx(thresh, cv2.MORPH_OPEN, pipeline.kernel_open, dst=out),
+        "close": lambda f: cv2.morphologyEx(out, cv2.MORPH_CLOSE, pipeline.kernel_close, dst=thresh),
+    }
+
+
+def bench_case(size, roi, clutter, noise, n_frames, repeat):
+    frames, roi_points, radius = make_case(size, roi, clutter, noise, n_frames)
+    min_area = int(0.5 * np.pi * radius ** 2)
+
+    full = ip.MaskPipeline(roi_points)
+    crop = ip.MaskPipeline(roi_points, crop=True)
+    # Masks for the trackers, computed up front so only tracking is timed
+    masks = [(crop(f).copy(), crop.offset) for f in frames]
+    labels = ip.label_buffer(masks[0][0].shape)
+    tracker = ip.WindowTracker(ip.MaskPipeline(roi_points, crop=True), min_area,
+                               window=8 * radius, backend=ip.TRACK_BACKEND)
+
+    stages = {
+        "mask": lambda f: ip.mask(f, roi_points),
+        "pipeline": full,
+        "pipeline_crop": crop,
+    }
+    # Stage by stage: each one runs on the previous one's output buffer, so
+    # they are timed in order over the same frame sequence
+    stages.update(pipeline_stages(ip.MaskPipeline(roi_points, crop=True), frames[0]))
+    stages.update({
+        "track_contours": lambda m: ip.track(m[0], min_area, offset=m[1]),
+        "track_components": lambda m: ip.track(m[0], min_area, offset=m[1], backend="components"),
+        "track_blob_buf": lambda m: ip.track_blob(m[0], min_area, offset=m[1], labels=labels),
+        "window_tracker": tracker,
+    })
+
+    results = {}
+    for name, fn in stages.items():
+        inputs = masks if name.startswith("track_") else frames
+        results[name] = summarize(time_calls(fn, inputs, repeat), alloc_per_call(fn, inputs))
+    drift = {backend: window_drift(frames, roi_points, min_area, 8 * radius, backend)
+             for backend in ("contours", "components")}
+    return {"size": size, "roi": roi, "clutter": clutter, "noise": noise,
+            "min_area": min_area, "window_full_searches": tracker.full_searches,
+            "window_drift_px": {b: d for b, (d, _) in drift.items()},
+            "window_mismatches": {b: m for b, (_, m) in drift.items()}, "stages": results}
+
+
+# ---------------- Reporting ----------------
+def machine_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": commit,
+            "machine": platform.machine(), "platform": platform.platform(),
+            "processor": platform.processor(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "opencv": cv2.__version__, "opencv_threads": cv2.getNumThreads()}
+
+
+def case_key(case):
+    return (case["size"], case["roi"], case["clutter"], case["noise"])
+
+
+def print_case(case, previous=None):
+    print(f"size {case['size']:>4}  roi {case['roi']:.2f}  clutter {case['clutter']:>3}  noise {case['noise']:>4}")
+    for name, s in case["stages"].items():
+        line = (f"    {name:<17} {s['mean_ms']:8.3f} ms  p95 {s['p95_ms']:8.3f} ms  "
+                f"{s['fps']:9.0f} fps  peak {s['peak_alloc_bytes'] / 1024:9.1f} KiB  "
+                f"{s['alloc_blocks']:6.1f} blocks")
+        if previous is not None and name in previous["stages"]:
+            line += f"  x{s['mean_ms'] / previous['stages'][name]['mean_ms']:.2f} vs old"
+        print(line)
+    for backend, drift in case["window_drift_px"].items():
+        print(f"    window vs whole ROI ({backend}): max {drift:.2f} px, "
+              f"{case['window_mismatches'][backend]} found/lost mismatches")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image_processing on synthetic frames")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[320, 640, 1280])
+    parser.add_argument("--rois", type=float, nargs="+", default=[0.25, 0.5, 1.0],
+                        help="ROI side as a fraction of the frame side")
+    parser.add_argument("--clutter", type=int, nargs="+", default=[0, 10, 50])
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.0, 8.0, 20.0])
+    parser.add_argument("--frames", type=int, default=16, help="distinct frames per case")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per stage")
+    parser.add_argument("--out", default=time.strftime("../data/%Y%m%d_%Hh%Mm%Ss_bench_vision.json"))
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = {case_key(c): c for c in json.load(f)["cases"]}
+
+    cases = []
+    for size, roi, clutter, noise in itertools.product(args.sizes, args.rois, args.clutter, args.noise):
+        case = bench_case(size, roi, clutter, noise, args.frames, args.repeat)
+        print_case(case, previous.get(case_key(case)))
+        cases.append(case)
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"machine": machine_info(), "args": vars(args), "cases": cases}, f, indent=1)
+    print(f"Results written to {args.out}")
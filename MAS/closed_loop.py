@@ -1,4 +1,5 @@
 import sys
+import time
 import cv2
 import numpy as np
 from PyQt6.QtCore import QTimer, Qt, QPoint
@@ -10,7 +11,7 @@ from PyQt6.QtWidgets import (
 
 import image_processing as ip
 import movement as mv
-import controllers as ctlr
+from control_worker import ControlWorker
 
 
 class CameraWidget(QMainWindow):
@@ -21,17 +22,18 @@ class CameraWidget(QMainWindow):
         self.setFixedSize(700, 700)
 
         # Camera
-        self.camera = ip.PiCamera()
+        # Native mode: vision runs on unrotated frames, only the display is rotated
+        self.camera = ip.PiCamera(threaded=True, native=True)
         ret, first_frame = self.camera.read()
         if not ret:
             raise RuntimeError("Could not read first frame from PiCamera")
 
+        first_frame = self.camera.orient(first_frame)
         self._frame_size = (first_frame.shape[1], first_frame.shape[0])  # (width, height)
 
         # ROI + Target
         self.roi_points = []
         self.roi_mask = None
-        self.target = None
         self.select_target_mode = False
         self.show_pos_cursor = True
 
@@ -39,9 +41,6 @@ class CameraWidget(QMainWindow):
         self.draw_mode = False
         self.drawing = False           # True while mouse is pressed & moving
         self.overlay_points = []       # list of (x_frame, y_frame) waypoints (virtual path)
-        self.current_target_idx = 0
-        self.path_follow_mode = False
-        self.advance_radius = 8       # pixels threshold to advance to next waypoint
         self._last_draw_point = None   # last point sampled while dragging
 
         # --- Video feed as main focus ---
@@ -78,6 +77,13 @@ class CameraWidget(QMainWindow):
         self.clear_path_button.clicked.connect(self.clear_path)
         self.clear_path_button.setEnabled(False)
 
+        self.profile_button = QPushButton("Profile")
+        self.profile_button.setCheckable(True)
+        self.profile_button.clicked.connect(self.toggle_profile)
+
+        self.dump_timings_button = QPushButton("Dump Timings")
+        self.dump_timings_button.clicked.connect(self.dump_timings)
+
         self.position_label = QLabel("Position: -,-")
         self.position_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.position_label.setFixedWidth(130)
@@ -86,6 +92,10 @@ class CameraWidget(QMainWindow):
         self.error_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.error_label.setFixedWidth(150)
 
+        self.latency_label = QLabel("Latency: -")
+        self.latency_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.latency_label.setFixedWidth(110)
+
         bottom_layout = QHBoxLayout()
         bottom_layout.addWidget(self.toggle_button)
         bottom_layout.addWidget(self.toggle_target_button)
@@ -93,9 +103,12 @@ class CameraWidget(QMainWindow):
         bottom_layout.addWidget(self.start_stop_button)
         bottom_layout.addWidget(self.draw_path_button)
         bottom_layout.addWidget(self.clear_path_button)
+        bottom_layout.addWidget(self.profile_button)
+        bottom_layout.addWidget(self.dump_timings_button)
         bottom_layout.addStretch(1)
         bottom_layout.addWidget(self.position_label)
         bottom_layout.addWidget(self.error_label)
+        bottom_layout.addWidget(self.latency_label)
 
         main_layout = QVBoxLayout()
         main_layout.addWidget(self.video_label, stretch=1)
@@ -105,28 +118,36 @@ class CameraWidget(QMainWindow):
         container.setLayout(main_layout)
         self.setCentralWidget(container)
 
-        # Timer for updates
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_frame)
-        self.timer.start(30)
-
         # State used for mapping clicks
         self._pixmap_size = (0, 0)
         self._label_size = (self.video_label.width(), self.video_label.height())
 
-        # Movement + controllers
+        # Movement + control loop (runs on its own thread)
         self.x_coil = mv.Coil(FWD=17, BWD=27)
         self.y_coil = mv.Coil(FWD=13, BWD=5)
-        # create controllers, setpoint will be set per waypoint during following
-        self.ctl_x = ctlr.PID("x", kp=1.0, ki=0.0, kd=0.0, setpoint=0, output_limits=(-60, 60))
-        self.ctl_y = ctlr.PID("y", kp=5.0, ki=0.0, kd=0.0, setpoint=0, output_limits=(-60, 60))
+        self.worker = ControlWorker(self.camera, self.x_coil, self.y_coil, rate=30.0)
+        self.worker.start_thread()
 
-        # Start/stop flag
+        # Start/stop flag, and the worker run it started
         self.running = False
+        self._run_id = None
+
+        # Rendering: capped independently of the control rate, into reused buffers
+        self.display_fps = 15
+        self._last_rendered = None     # ControlState shown last
+        self._display_buf = None       # oriented camera frame + overlays
+        self._scaled_buf = None        # frame scaled to the label
+        self._scale_key = None         # (label w, label h, frame w, frame h, is_mask, device ratio) of _scaled_buf
+
+        # Timer for rendering the latest control state
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_frame)
+        self.timer.start(int(1000 / self.display_fps))
 
     # --- UI control callbacks ---
     def toggle_view(self):
         self.show_mask = not getattr(self, 'show_mask', False)
+        self.worker.publish_mask = self.show_mask
         self.toggle_button.setText("Show Camera Feed" if self.show_mask else "Show Mask")
 
     def toggle_target_mode(self):
@@ -142,34 +163,32 @@ class CameraWidget(QMainWindow):
         self.running = self.start_stop_button.isChecked()
         if self.running:
             # Start path-following if a path exists; else if a single target exists, resume single target behavior
+            self._run_id = self.worker.start(self.overlay_points)
+            self.start_stop_button.setText("Stop")
             if self.overlay_points:
-                self.path_follow_mode = True
-                self.current_target_idx = 0
-                wp = self.overlay_points[0]
-                self.ctl_x.setpoint = wp[0]
-                self.ctl_y.setpoint = wp[1]
-                self.start_stop_button.setText("Stop")
                 print("Path-following started.")
             else:
                 # existing single-target start behavior
-                self.path_follow_mode = False
-                self.start_stop_button.setText("Stop")
                 print("Coils activated. Tracking started.")
         else:
             # Stop all control
-            self.start_stop_button.setText("Start")
-            self.ctl_x = ctlr.PID("x", kp=self.ctl_x.kp, ki=self.ctl_x.ki, kd=self.ctl_x.kd,
-                                 setpoint=0, output_limits=self.ctl_x.output_limits)
-            self.ctl_y = ctlr.PID("y", kp=self.ctl_y.kp, ki=self.ctl_y.ki, kd=self.ctl_y.kd,
-                                 setpoint=0, output_limits=self.ctl_y.output_limits)
-            self.target = None
-            self.position_label.setText("Position: -,-")
-            self.error_label.setText("Error: -,-")
-            self.x_coil.set_magnetic_field(0)
-            self.y_coil.set_magnetic_field(0)
-            self.path_follow_mode = False
+            self.worker.stop()
+            self._show_stopped()
             print("Coils deactivated. Target cleared.")
 
+    def _show_stopped(self):
+        self.start_stop_button.setText("Start")
+        self.position_label.setText("Position: -,-")
+        self.error_label.setText("Error: -,-")
+
+    def toggle_profile(self):
+        # Stage timings + on-screen overlay
+        self.worker.timer.enabled = self.profile_button.isChecked()
+
+    def dump_timings(self):
+        path = self.worker.timer.dump(time.strftime("../data/%Y%m%d_%Hh%Mm%Ss_timings.json"))
+        print(f"Stage timings written to {path}")
+
     def toggle_draw_mode(self):
         self.draw_mode = self.draw_path_button.isChecked()
         self.draw_path_button.setText("Drawing..." if self.draw_mode else "Draw Path")
@@ -183,7 +202,6 @@ class CameraWidget(QMainWindow):
 
     def clear_path(self):
         self.overlay_points = []
-        self.current_target_idx = 0
         self.clear_path_button.setEnabled(False)
         print("Path cleared.")
 
@@ -205,6 +223,7 @@ class CameraWidget(QMainWindow):
                     frame_w = self._frame_size[0]
                     self.roi_mask = np.zeros((frame_h, frame_w), dtype=np.uint8)
                     cv2.fillPoly(self.roi_mask, [np.array(self.roi_points, dtype=np.int32)], 255)
+                    self.worker.set_roi(self.roi_points)
                     print("ROI set.")
                     # enable draw path button now ROI exists
                     self.draw_path_button.setEnabled(True)
@@ -224,10 +243,8 @@ class CameraWidget(QMainWindow):
         # If select_target_mode, set target as before
         if self.select_target_mode:
             if self.roi_mask[y_frame, x_frame] > 0:
-                self.target = (x_frame, y_frame)
-                print(f"New target set: {self.target}")
-                self.ctl_x.setpoint = self.target[0]
-                self.ctl_y.setpoint = self.target[1]
+                self.worker.set_target((x_frame, y_frame))
+                print(f"New target set: {(x_frame, y_frame)}")
             else:
                 print("Click ignored: outside ROI")
             return
@@ -294,14 +311,39 @@ class CameraWidget(QMainWindow):
         y_frame = max(0, min(frame_h - 1, y_frame))
         return x_frame, y_frame
 
-    # --- Main loop ---
+    # --- Render the latest control state (GUI thread) ---
     def update_frame(self):
-        ret, frame = self.camera.read()
-        if not ret:
+        state = self.worker.latest_state()
+        if state is None or state is self._last_rendered:
             return
+        self._last_rendered = state
+        timer = self.worker.timer
+        t0 = timer.start()
+        self._render(state)
+        timer.stop("render", t0)
+
+    def _render(self, state):
+        # The control loop stopped by itself (final waypoint reached); states
+        # published before Start belong to an older run
+        if self.running and state.finished and state.run_id == self._run_id:
+            self.running = False
+            self.start_stop_button.setChecked(False)
+            self._show_stopped()
+            return
+
+        # The control loop failed: it has already zeroed the coils
+        if state.fault is not None:
+            if self.running and state.run_id == self._run_id:
+                self.running = False
+                self.start_stop_button.setChecked(False)
+                self._show_stopped()
+            if state.frame is None:
+                self.error_label.setText("Control error")
+                return
+        self.error_label.setToolTip(state.fault or "")
 
-        self._frame_size = self.camera.get_frame_size()
-        display_frame = frame.copy()
+        self._display_buf = self.camera.orient(state.frame, dst=self._display_buf)
+        display_frame = self._display_buf
 
         if self.roi_mask is None:
             for p in self.roi_points:
@@ -312,80 +354,31 @@ class CameraWidget(QMainWindow):
             self.display_frame(display_frame)
             return
 
-        # Mask + tracking
-        comp_mask = ip.mask(frame, roi_points=self.roi_points)
-        pos = ip.track(comp_mask, min_area=500)
-
+        pos = state.pos
         if pos is not None:
             if self.show_pos_cursor:
-                cv2.circle(display_frame, pos, radius=6, color=(255, 0, 0), thickness=2)
+                cv2.circle(display_frame, (int(round(pos[0])), int(round(pos[1]))),
+                           radius=6, color=(255, 0, 0), thickness=2)
 
             # --- Position display ---
             self.position_label.setText(f"Position: {pos[0]:.1f}, {pos[1]:.1f}")
 
-            # --- Line-following or single-target behavior ---
-            if self.path_follow_mode and self.overlay_points and self.running:
-                # ensure current index is valid
-                if self.current_target_idx >= len(self.overlay_points):
-                    self.current_target_idx = len(self.overlay_points) - 1
-
-                waypoint = self.overlay_points[self.current_target_idx]
-                cv2.circle(display_frame, waypoint, radius=5, color=(0, 0, 255), thickness=2)
+            if state.waypoint is not None:
+                cv2.circle(display_frame, state.waypoint, radius=5, color=(0, 0, 255), thickness=2)
+            elif state.running and state.target is not None:
+                cv2.circle(display_frame, state.target, radius=6, color=(0, 0, 255), thickness=2)
 
-                # compute error (use ip.calculate_error if available)
-                try:
-                    err_x, err_y, err_abs = ip.calculate_error(pos, waypoint)
-                except Exception:
-                    err_x = waypoint[0] - pos[0]
-                    err_y = waypoint[1] - pos[1]
-                    err_abs = (err_x ** 2 + err_y ** 2) ** 0.5
+            if state.latency is not None:
+                self.latency_label.setText(f"Latency: {state.latency * 1000:.1f} ms")
 
+            if state.error is not None:
+                err_x, err_y, err_abs = state.error
                 self.error_label.setText(f"Error: {err_x:.1f}, {err_y:.1f} (|{err_abs:.1f}|)")
-
-                # update PID setpoints to current waypoint and compute outputs
-                try:
-                    self.ctl_x.setpoint = waypoint[0]
-                    self.ctl_y.setpoint = waypoint[1]
-                    pid_x_out = self.ctl_x.compute(pos[0])
-                    pid_y_out = self.ctl_y.compute(pos[1])
-                except TypeError:
-                    # some PID implementations accept setpoint as compute param
-                    pid_x_out = self.ctl_x.compute(pos[0], setpoint=waypoint[0])
-                    pid_y_out = self.ctl_y.compute(pos[1], setpoint=waypoint[1])
-
-                # apply outputs to coils
-                self.x_coil.set_magnetic_field(pid_x_out)
-                self.y_coil.set_magnetic_field(pid_y_out)
-
-                # advance when close enough
-                if err_abs < self.advance_radius:
-                    if self.current_target_idx < len(self.overlay_points) - 1:
-                        self.current_target_idx += 1
-                        print("Advancing to waypoint", self.current_target_idx)
-                    else:
-                        # reached final waypoint: stop following
-                        print("Reached final waypoint. Stopping.")
-                        self.start_stop_button.setChecked(False)
-                        self.toggle_start_stop()
-            elif self.target is not None and self.running and not self.path_follow_mode:
-                # original single-target PID behavior (unchanged)
-                cv2.circle(display_frame, self.target, radius=6, color=(0, 0, 255), thickness=2)
-                error = ip.calculate_error(pos, self.target)
-                if error:
-                    err_x, err_y, err_abs = error
-                    self.error_label.setText(f"Error: {err_x:.1f}, {err_y:.1f} (|{err_abs:.1f}|)")
-                    if self.ctl_x and self.ctl_y:
-                        pid_x_out = self.ctl_x.compute(pos[0])
-                        pid_y_out = self.ctl_y.compute(pos[1])
-                        self.x_coil.set_magnetic_field(pid_x_out)
-                        self.y_coil.set_magnetic_field(pid_y_out)
-                else:
-                    self.error_label.setText("Error: -,-")
             else:
-                self.error_label.setText("Error: -,-")
+                self.error_label.setText("Control error" if state.fault else "Error: -,-")
         else:
             self.position_label.setText("Position: None")
-            self.error_label.setText("Error: -,-")
+            self.error_label.setText("Control error" if state.fault else "Error: -,-")
 
         # Draw the overlay path (only inside ROI points)
         if len(self.overlay_points) >= 2:
@@ -399,41 +392,56 @@ class CameraWidget(QMainWindow):
             cv2.polylines(display_frame, [np.array(self.roi_points, dtype=np.int32)],
                           isClosed=True, color=(0, 255, 255), thickness=1)
 
-        if getattr(self, 'show_mask', False):
+        # Stage timing overlay
+        if self.worker.timer.enabled:
+            for i, line in enumerate(self.worker.timer.summary_lines()):
+                cv2.putText(display_frame, line, (5, 15 + 14 * i), cv2.FONT_HERSHEY_PLAIN,
+                            0.9, (0, 255, 0), 1)
+
+        if getattr(self, 'show_mask', False) and state.mask is not None:
             # If mask display desired, try to show comp_mask
-            self.display_frame(comp_mask, is_mask=True)
+            self.display_frame(self.camera.orient(state.mask), is_mask=True)
         else:
             self.display_frame(display_frame)
 
     # --- Render to QLabel ---
     def display_frame(self, frame, is_mask=False):
-        if is_mask:
-            h, w = frame.shape[:2]
-            qimg = QImage(frame.data, w, h, frame.strides[0], QImage.Format.Format_Grayscale8)
-        else:
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            h, w = rgb.shape[:2]
-            qimg = QImage(rgb.data, w, h, rgb.strides[0], QImage.Format.Format_RGB888)
-
-        pixmap = QPixmap.fromImage(qimg)
-
+        h, w = frame.shape[:2]
         label_w = self.video_label.width()
         label_h = self.video_label.height()
+        device_ratio = self.video_label.devicePixelRatioF()
+
+        # The scaled geometry (and its buffer) only changes with the label, frame
+        # size or screen scaling. The buffer is in device pixels; clicks arrive in
+        # logical (label) pixels, so the mapping uses the logical pixmap size
+        key = (label_w, label_h, w, h, is_mask, device_ratio)
+        if key != self._scale_key:
+            scale = min(label_w / w, label_h / h) * device_ratio
+            pix_w, pix_h = max(1, int(w * scale)), max(1, int(h * scale))
+            shape = (pix_h, pix_w) if is_mask else (pix_h, pix_w, 3)
+            self._scaled_buf = np.empty(shape, dtype=np.uint8)
+            self._scale_key = key
+            self._pixmap_size = (int(pix_w / device_ratio), int(pix_h / device_ratio))
+            self._label_size = (label_w, label_h)
+            self._frame_size = (w, h)
+
+        # Scale with OpenCV into the reused buffer; Qt reads the BGR data as is
+        pix_h, pix_w = self._scaled_buf.shape[:2]
+        cv2.resize(frame, (pix_w, pix_h), dst=self._scaled_buf, interpolation=cv2.INTER_NEAREST)
+        fmt = QImage.Format.Format_Grayscale8 if is_mask else QImage.Format.Format_BGR888
+        qimg = QImage(self._scaled_buf.data, pix_w, pix_h, self._scaled_buf.strides[0], fmt)
 
-        scaled_pixmap = pixmap.scaled(label_w, label_h, Qt.AspectRatioMode.KeepAspectRatio)
-
-        device_ratio = scaled_pixmap.devicePixelRatio()
-        logical_pix_w = int(scaled_pixmap.width() / device_ratio)
-        logical_pix_h = int(scaled_pixmap.height() / device_ratio)
-
-        self._pixmap_size = (logical_pix_w, logical_pix_h)
-        self._label_size = (label_w, label_h)
-        self._frame_size = (w, h)
-
-        self.video_label.setPixmap(scaled_pixmap)
+        pixmap = QPixmap.fromImage(qimg)
+        pixmap.setDevicePixelRatio(device_ratio)
+        self.video_label.setPixmap(pixmap)
 
     # --- close event cleanup ---
     def closeEvent(self, event):
+        self.timer.stop()
+        try:
+            self.worker.shutdown()
+        except Exception:
+            pass
         try:
             self.camera.release()
         except Exception:
@@ -0,0 +1,80 @@
+"""Affine PWM -> current -> field calibration of the six coils.
+
+No hardware access: waveforms.py, rotating_fields.py and hardware/coils.py
+all import it, on or off the Pi.
+"""
+import numpy as np
+
+M1 = np.array([0.1047, 0.1111, 0.1500, 0.1579, 0.2195, 0.2250])
+M1 = np.diag(M1)
+b1 = np.array([1, 1, 1, 1, 1, 1])
+
+M2 = np.array([0.1047, 0.1111, 0.1500, 0.1579, 0.2195, 0.2250])
+M2 = np.diag(M2)
+b2 = np.array([0.1489, 0.2567, -0.1000, -0.1667, 0.0000, -0.0556])
+
+M3 = M2 @ M1
+b3 = M2 @ b1 + b2
+
+# Coil order of the 6-vectors: [Z1, Z2, Y3, Y4, X5, X6]; a (bx, by, bz)
+# target drives both coils of an axis alike
+AXIS_TO_COILS = [2, 2, 1, 1, 0, 0]
+
+
+class Calibration:
+    """Affine PWM -> current -> field calibration of the six coils.
+
+    The inverse transforms are computed once here instead of on every call,
+    and every method takes a single vector or a whole array of them: (6,) or
+    (N, 6) per coil, so a full waveform (e.g. N samples of a rotating field)
+    goes through the real calibration in one vectorised call. Field targets
+    may also be (3,) or (N, 3) as (bx, by, bz), see expand()."""
+
+    def __init__(self, M1, b1, M2, b2, pwm_limit=100.0):
+        self.M1, self.b1 = np.asarray(M1, dtype=float), np.asarray(b1, dtype=float)
+        self.M2, self.b2 = np.asarray(M2, dtype=float), np.asarray(b2, dtype=float)
+        self.M3 = self.M2 @ self.M1
+        self.b3 = self.M2 @ self.b1 + self.b2
+        self.pwm_limit = pwm_limit  # |duty| the drivers can deliver [%]
+
+        # Row-vector form (x @ A.T == (A @ x.T).T) so (N, 6) arrays map in one matmul
+        self._M1_T, self._M2_T, self._M3_T = self.M1.T, self.M2.T, self.M3.T
+        self._M1_inv_T = np.linalg.inv(self.M1).T
+        self._M2_inv_T = np.linalg.inv(self.M2).T
+        self._M3_inv_T = np.linalg.inv(self.M3).T
+
+    @staticmethod
+    def expand(B):
+        """(..., 3) (bx, by, bz) targets -> (..., 6) per coil; (..., 6) unchanged."""
+        B = np.asarray(B, dtype=float)
+        return B[..., AXIS_TO_COILS] if B.shape[-1] == 3 else B
+
+    def pwm_to_current(self, PWM):
+        return np.asarray(PWM, dtype=float) @ self._M1_T + self.b1  # Current [A]
+
+    def current_to_field(self, I):
+        return np.asarray(I, dtype=float) @ self._M2_T + self.b2  # Field Strength [mT]
+
+    def pwm_to_field(self, PWM):
+        return np.asarray(PWM, dtype=float) @ self._M3_T + self.b3  # Field Strength [mT]
+
+    def field_to_current(self, B):
+        return (self.expand(B) - self.b2) @ self._M2_inv_T  # Current [A]
+
+    def current_to_pwm(self, I):
+        return (np.asarray(I, dtype=float) - self.b1) @ self._M1_inv_T  # Duty Cycle [%]
+
+    def field_to_pwm(self, B):
+        return (self.expand(B) - self.b3) @ self._M3_inv_T  # Duty Cycle [%]
+
+    def field_to_duty(self, B, limit=None):
+        """Duty cycles [%] for field targets, clipped to +-limit (default
+        pwm_limit), and a boolean array of the same shape marking the coils
+        (samples) that had to be clipped, i.e. fields the coils cannot reach."""
+        limit = self.pwm_limit if limit is None else limit
+        PWM = self.field_to_pwm(B)
+        saturated = np.abs(PWM) > limit
+        return np.clip(PWM, -limit, limit), saturated
+
+
+CALIBRATION = Calibration(M1, b1, M2, b2)
@@ -0,0 +1,104 @@
+import pwm_backends
+
+
+class CoilDriver:
+    """Write-coalescing layer over the coil GPIO (direction pins and PWM channels).
+
+    The last level / duty written to every channel is cached and a write only
+    reaches the hardware when the value actually changes (duties are compared
+    after rounding to `resolution` % duty, well below what the 1 kHz software
+    PWM can resolve). apply() takes the updates for several channels at once:
+    duties that go down are written first, then the direction pins (in a single
+    output() call), then duties that go up, so an H-bridge never sees a
+    high duty with a stale direction.
+
+    writes / skipped count the hardware writes made and avoided.
+    """
+
+    def __init__(self, gpio=None, pwm_freq=1000, resolution=0.1):
+        # gpio: an RPi.GPIO-like backend, by default the configured one (see pwm_backends)
+        self.gpio = gpio if gpio is not None else pwm_backends.get_backend()
+        self.pwm_freq = pwm_freq
+        self.resolution = resolution
+        self._pins = {}     # name -> [pin, level]
+        self._pwm = {}      # name -> [PWM object, duty]
+        self._owned = []    # every pin set up here (the backend may be shared)
+        self.writes = 0
+        self.skipped = 0
+
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setwarnings(False)
+
+    # ---------------- Channels ----------------
+    def add_pin(self, name, pin):
+        self.gpio.setup(pin, self.gpio.OUT)
+        self._owned.append(pin)
+        self.gpio.output(pin, self.gpio.LOW)
+        self._pins[name] = [pin, self.gpio.LOW]
+
+    def add_pwm(self, name, pin):
+        self.gpio.setup(pin, self.gpio.OUT)
+        self._owned.append(pin)
+        pwm = self.gpio.PWM(pin, self.pwm_freq)
+        pwm.start(0)
+        self._pwm[name] = [pwm, 0.0]
+
+    # ---------------- Updates ----------------
+    def apply(self, updates):
+        """Write {channel name: value} as one batch: a duty cycle [%] for PWM
+        channels, GPIO.HIGH / GPIO.LOW for pins. Unchanged values are skipped."""
+        down, up, pins, levels = [], [], [], []
+        for name, value in updates.items():
+            if name in self._pwm:
+                state = self._pwm[name]
+                duty = round(value / self.resolution) * self.resolution
+                if duty == state[1]:
+                    self.skipped += 1
+                    continue
+                (down if duty < state[1] else up).append((state, duty))
+            else:
+                state = self._pins[name]
+                if value == state[1]:
+                    self.skipped += 1
+                    continue
+                state[1] = value
+                pins.append(state[0])
+                levels.append(value)
+
+        for state, duty in down:
+            state[0].ChangeDutyCycle(duty)
+            state[1] = duty
+        if pins:
+            self.gpio.output(pins, levels)
+        for state, duty in up:
+            state[0].ChangeDutyCycle(duty)
+            state[1] = duty
+        self.writes += len(down) + len(up) + len(pins)
+
+    def set(self, name, value):
+        self.apply({name: value})
+
+    def value(self, name):
+        # Last value written to a channel
+        return self._pwm[name][1] if name in self._pwm else self._pins[name][1]
+
+    def stats(self):
+        total = self.writes + self.skipped
+        return f"GPIO writes: {self.writes}, skipped: {self.skipped} ({100 * self.skipped / total if total else 0:.0f}%)"
+
+    # ---------------- Cleanup ----------------
+    def cleanup(self):
+        for pwm, _ in self._pwm.values():
+            try:
+                pwm.ChangeDutyCycle(0)
+                pwm.stop()
+            except Exception:
+                pass
+        for pin, _ in self._pins.values():
+            try:
+                self.gpio.output(pin, self.gpio.LOW)
+            except Exception:
+                pass
+        # Only this driver's pins: other drivers may share the backend
+        self.gpio.cleanup(self._owned)
+        self._owned = []
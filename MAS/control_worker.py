@@ -0,0 +1,283 @@
+"""Control loop of closed_loop.py, without the GUI.
+
+ControlWorker runs capture -> mask -> track -> estimate -> PID -> coils on its
+own thread; replay.py drives the same _step() with recorded frames.
+"""
+import threading
+import time
+import traceback
+from collections import namedtuple
+import numpy as np
+import image_processing as ip
+import controllers as ctlr
+import estimators as est
+import telemetry as tm
+import profiling
+
+
+# Snapshot of the control loop, published by ControlWorker for the GUI to render.
+# frame/mask are native camera images; all points are in display coordinates.
+ControlState = namedtuple("ControlState", [
+    "frame", "mask", "timestamp", "pos", "target", "waypoint", "error",
+    "running", "path_follow_mode", "current_target_idx",
+    "latency",    # capture -> coil write of this sample [s], None if no actuation
+    "run_id",     # run counter, incremented by every start()
+    "finished",   # run run_id reached its final waypoint
+    "fault",      # last exception of the control loop (control stopped), None if none
+])
+
+
+class ControlWorker:
+    """Runs capture -> mask -> track -> estimate -> PID -> coils on its own
+    thread at a fixed rate. The GUI never blocks this loop: it only sends
+    commands (ROI, target, start/stop) and renders the latest ControlState."""
+
+    def __init__(self, camera, x_coil, y_coil, rate=30.0, telemetry="closed_loop",
+                 backend=ip.TRACK_BACKEND):
+        self.camera = camera
+        self.x_coil = x_coil
+        self.y_coil = y_coil
+        self.period = 1.0 / rate
+        self.backend = backend
+        # Clock of the frame timestamps (replay.py uses the recorded frame time)
+        self.clock = time.monotonic
+
+        # Telemetry, written on its own thread: a name opens a new TelemetryWriter
+        # (its own file) in every start() and closes it when the run stops; a
+        # writer is shared by all runs and closed by its owner; None disables it
+        self.telemetry_name = telemetry if isinstance(telemetry, str) else None
+        self.telemetry = None if isinstance(telemetry, str) else telemetry
+        # Per-stage latencies (enabled from the GUI)
+        self.timer = profiling.StageTimer()
+
+        # x and y controllers in one, setpoint will be set per waypoint during following
+        self.ctl = ctlr.VectorPID(("x", "y"), kp=(1.0, 5.0), ki=0.0, kd=0.0, setpoint=0,
+                                  output_limits=(-60, 60), telemetry=self.telemetry)
+
+        # Vision (created once the ROI is known)
+        self.mask_pipeline = None
+        self.tracker = None
+        # Agent state (display coordinates); the controllers run from this estimate,
+        # predicted to the time of the coil write unless latency_compensation is off
+        self.estimator = est.ConstantVelocityKalman()
+        self.latency_compensation = True
+
+        # Control state
+        self.target = None
+        self.path = []
+        self.current_target_idx = 0
+        self.path_follow_mode = False
+        self.advance_radius = 8       # pixels threshold to advance to next waypoint
+        self.running = False
+        self.run_id = 0
+        self.finished = False
+        self.fault = None
+        self.publish_mask = False     # set by the GUI when the mask view is shown
+
+        self._lock = threading.Lock()  # guards everything above against the GUI thread
+        self._state = None
+        self._active = False
+        self._thread = None
+
+    # --- Thread control ---
+    def start_thread(self):
+        self._active = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._active = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        with self._lock:
+            self._stop()
+
+    def latest_state(self):
+        with self._lock:
+            return self._state
+
+    # --- Commands (called from the GUI thread) ---
+    def set_roi(self, roi_points):
+        # ROI points are clicked on the display, the pipeline works on native frames
+        native_roi = [self.camera.to_native(p) for p in roi_points]
+        mask_pipeline = ip.MaskPipeline(native_roi, crop=True)
+        tracker = ip.WindowTracker(mask_pipeline, min_area=500, backend=self.backend, timer=self.timer)
+        with self._lock:
+            self.mask_pipeline = mask_pipeline
+            self.tracker = tracker
+            self.estimator = est.ConstantVelocityKalman()
+
+    def set_target(self, target):
+        with self._lock:
+            self.target = target
+            self.ctl.setpoint[:] = target
+
+    def start(self, path):
+        # Start path-following if a path is given; else resume single target behavior
+        with self._lock:
+            self.running = True
+            self.run_id += 1
+            if self.telemetry_name is not None:
+                self._close_telemetry()
+                self.telemetry = self.ctl.telemetry = tm.TelemetryWriter(self.telemetry_name)
+            self.finished = False
+            self.fault = None
+            self.path = list(path)
+            self.current_target_idx = 0
+            self.path_follow_mode = bool(self.path)
+            if self.path_follow_mode:
+                wp = self.path[0]
+                self.ctl.setpoint[:] = wp
+            return self.run_id
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        # Stop all control (lock held)
+        self.ctl.reset()
+        self.ctl.setpoint[:] = 0
+        self.target = None
+        self.x_coil.set_magnetic_field(0)
+        self.y_coil.set_magnetic_field(0)
+        self.path_follow_mode = False
+        self.running = False
+        self._close_telemetry()
+
+    def _close_telemetry(self):
+        # End the run's own telemetry file, flushing what is queued (lock held)
+        if self.telemetry_name is not None and self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = self.ctl.telemetry = None
+
+    # --- Control loop ---
+    def _loop(self):
+        next_tick = time.monotonic()
+        while self._active:
+            latest = None
+            try:
+                latest = self.camera.read_latest(timeout=self.period)
+                if latest is not None:
+                    self._step(latest)
+            except Exception as e:
+                self._fail(e, latest)
+
+            # Fixed rate: wait for the next deadline, skipping any that were missed
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+
+    def _fail(self, e, latest):
+        # Any error in the loop: zero the coils and tell the GUI, keep the thread alive
+        fault = f"{type(e).__name__}: {e}"
+        if fault != self.fault:
+            traceback.print_exc()
+        with self._lock:
+            self._stop()
+            self.fault = fault
+            previous = self._state
+            self._state = ControlState(
+                frame=latest.image if latest is not None else previous and previous.frame, mask=None,
+                timestamp=latest.timestamp if latest is not None else previous and previous.timestamp,
+                pos=None, target=None, waypoint=None, error=None, running=False,
+                path_follow_mode=False, current_target_idx=self.current_target_idx, latency=None,
+                run_id=self.run_id, finished=False, fault=self.fault,
+            )
+
+    def _step(self, latest):
+        step_t0 = self.timer.start()
+        # Frame age when the loop picks it up (sensor -> control thread)
+        self.timer.record("capture", int((self.clock() - latest.timestamp) * 1e9))
+        frame = latest.image
+        with self._lock:
+            tracker, estimator = self.tracker, self.estimator
+
+        pos = None
+        ctl_pos = None
+        mask = None
+        if tracker is not None:
+            # Search around the estimator's prediction, then fuse the sub-pixel
+            # detection (or coast through a missed one)
+            prediction = None
+            if estimator.initialized:
+                prediction, _ = estimator.predict(latest.timestamp)
+                prediction = self.camera.to_native(tuple(prediction))
+            found = tracker(frame, prediction=prediction) is not None
+            t0 = self.timer.start()
+            if found:
+                estimate = estimator.update(self.camera.to_display(tracker.centroid), latest.timestamp)
+            else:
+                estimate = estimator.coast(latest.timestamp)
+            pos = None if estimate is None else (float(estimate[0]), float(estimate[1]))
+            ctl_pos = pos
+            if pos is not None and self.latency_compensation:
+                # The coils act now, not when the frame was captured: control
+                # from the position the estimated velocity gives at this time
+                lead, _ = estimator.predict(self.clock())
+                ctl_pos = (float(lead[0]), float(lead[1]))
+            self.timer.stop("estimate", t0)
+            if self.publish_mask:
+                # only the searched window while the agent is tracked
+                mask = tracker.pipeline.full_mask(tracker.mask).copy()
+
+        with self._lock:
+            waypoint = None
+            error = None
+            latency = None
+            if pos is not None and self.running:
+                if self.path_follow_mode and self.path:
+                    waypoint, error = self._follow_path(ctl_pos, latest.timestamp)
+                    latency = self.clock() - latest.timestamp
+                elif self.target is not None:
+                    error = ip.calculate_error(ctl_pos, self.target)
+                    self._actuate(ctl_pos, latest.timestamp)
+                    latency = self.clock() - latest.timestamp
+
+            self._state = ControlState(
+                frame=frame, mask=mask, timestamp=latest.timestamp, pos=pos,
+                target=self.target, waypoint=waypoint, error=error,
+                running=self.running, path_follow_mode=self.path_follow_mode,
+                current_target_idx=self.current_target_idx, latency=latency,
+                run_id=self.run_id, finished=self.finished, fault=self.fault,
+            )
+        self.timer.stop("step", step_t0)
+
+    def _actuate(self, pos, timestamp):
+        # dt for the controller comes from the frame timestamps
+        t0 = self.timer.start()
+        pid_x_out, pid_y_out = self.ctl.compute(np.array(pos), timestamp=timestamp)
+        self.timer.stop("pid", t0)
+
+        t0 = self.timer.start()
+        self.x_coil.set_magnetic_field(pid_x_out)
+        self.y_coil.set_magnetic_field(pid_y_out)
+        self.timer.stop("gpio", t0)
+
+    def _follow_path(self, pos, timestamp):
+        # ensure current index is valid
+        if self.current_target_idx >= len(self.path):
+            self.current_target_idx = len(self.path) - 1
+
+        waypoint = self.path[self.current_target_idx]
+        error = ip.calculate_error(pos, waypoint)
+
+        # update PID setpoints to current waypoint, compute and apply outputs
+        self.ctl.setpoint[:] = waypoint
+        self._actuate(pos, timestamp)
+
+        # advance when close enough
+        if error[2] < self.advance_radius:
+            if self.current_target_idx < len(self.path) - 1:
+                self.current_target_idx += 1
+                print("Advancing to waypoint", self.current_target_idx)
+            else:
+                # reached final waypoint: stop following
+                print("Reached final waypoint. Stopping.")
+                self._stop()
+                self.finished = True
+        return waypoint, error
@@ -1,25 +1,30 @@
 import time
+import numpy as np
 
 class PID:
     def __init__(self, axis, 
                  kp, ki, kd, 
                  setpoint=0, 
-                 output_limits=(None, None)):
+                 output_limits=(None, None),
+                 telemetry=None,
+                 kaw=0):
         self.axis=axis
         self.kp = kp
         self.ki = ki
         self.kd = kd
-        #self.kaw = 10 
+        self.kaw = kaw  # back-calculation anti-windup gain, 0 = off
         self.setpoint = setpoint
         self.output_limits = output_limits
+        self.telemetry = telemetry  # e.g. telemetry.TelemetryWriter; None disables logging
         
         self._integral = 0
         self._last_error = 0
         self._last_time = None
 
-    def compute(self, measurement):
-        # current time
-        now = time.time()
+    def compute(self, measurement, timestamp=None):
+        # timestamp: when the measurement was taken (time.monotonic() clock, e.g.
+        # CapturedFrame.timestamp). dt then follows the frames, not the call time.
+        now = time.monotonic() if timestamp is None else timestamp
         if self._last_time is None:
             self._last_time = now
             return 0
@@ -49,7 +54,7 @@ class PID:
             u_sat = min(high, u_sat)
 
         # --- back-calculation anti-windup ---
-        if hasattr(self, "kaw") and self.kaw > 0 and dt > 0:
+        if self.kaw > 0 and self.ki != 0 and dt > 0:
             # correct integral term based on difference
             self._integral += (self.kaw / self.ki) * (u_sat - u) * dt
             # recompute integral contribution
@@ -70,7 +75,7 @@ class PID:
     
 
     def step(self, measurement):
-        now = time.time()
+        now = time.monotonic()
         if self._last_time is None:
             self._last_time = now
             return 0
@@ -86,6 +91,97 @@ class PID:
         
     
     def log(self, axis, time, pos, ctrl_out, error, kp, ki, kd):
-        with open("../data/test.csv", "a", buffering=1, encoding="utf-8") as f:
-            data = f"{time},{axis},{pos},{self.setpoint},{ctrl_out},{error},{kp},{ki},{kd}\n"
-            f.write(data)
\ No newline at end of file
+        # Queued for the telemetry thread; never touches the disk here
+        if self.telemetry is not None:
+            self.telemetry.write((time, axis, pos, self.setpoint, ctrl_out, error, kp, ki, kd))
+
+
+
+class VectorPID:
+    """PID controller for several axes (and/or agents) at once.
+
+    Gains, setpoints, limits, integrators and derivative filters are NumPy
+    arrays, so one compute() call with a shared timestamp updates every axis.
+    The state shape is the broadcast of len(axes) (last dimension) with the
+    shapes of the gains, e.g. kp of shape (n_agents, 1) gives n_agents x axes.
+
+    output_limits: (low, high), scalars or arrays, None for unbounded
+    kaw: back-calculation anti-windup gain (0 = off)
+    d_filter: time constant [s] of a first order filter on the D term (0 = off)
+    """
+
+    def __init__(self, axes, kp, ki, kd, setpoint=0, output_limits=(None, None),
+                 kaw=0.0, d_filter=0.0, telemetry=None):
+        self.axes = tuple(axes)
+        self.shape = np.broadcast_shapes(np.shape(kp), np.shape(ki), np.shape(kd),
+                                         np.shape(kaw), np.shape(setpoint), (len(self.axes),))
+        full = lambda v: np.broadcast_to(np.asarray(v, dtype=float), self.shape).copy()
+
+        self.kp = full(kp)
+        self.ki = full(ki)
+        self.kd = full(kd)
+        self.kaw = full(kaw)
+        self.setpoint = full(setpoint)
+        low, high = output_limits
+        self.low = full(-np.inf if low is None else low)
+        self.high = full(np.inf if high is None else high)
+        self.d_filter = d_filter
+        self.telemetry = telemetry  # logged per axis when the state is 1-D
+
+        self.reset()
+
+    def reset(self):
+        # Clear the controller state (gains and setpoints are kept)
+        self._integral = np.zeros(self.shape)
+        self._last_error = np.zeros(self.shape)
+        self._d = np.zeros(self.shape)       # (filtered) error derivative
+        self._last_time = None
+
+    def compute(self, measurement, timestamp=None):
+        """Outputs for all axes given measurements of the state shape, taken at
+        timestamp (time.monotonic() clock; defaults to now)."""
+        now = time.monotonic() if timestamp is None else timestamp
+        error = self.setpoint - measurement
+        if self._last_time is None:
+            self._last_time = now
+            self._last_error = error
+            return np.zeros(self.shape)
+
+        dt = now - self._last_time
+        if dt > 0:
+            self._integral += error * dt
+            d_raw = (error - self._last_error) / dt
+            if self.d_filter > 0:
+                self._d += dt / (self.d_filter + dt) * (d_raw - self._d)
+            else:
+                self._d = d_raw
+
+        p = self.kp * error
+        d = self.kd * self._d
+        u = p + self.ki * self._integral + d
+        u_sat = np.clip(u, self.low, self.high)
+
+        # --- back-calculation anti-windup (where ki != 0) ---
+        if dt > 0:
+            windup = np.divide(self.kaw * (u_sat - u) * dt, self.ki,
+                               out=np.zeros(self.shape), where=self.ki != 0)
+            self._integral += windup
+            u_sat = np.clip(p + self.ki * self._integral + d, self.low, self.high)
+
+        self._last_error = error
+        self._last_time = now
+
+        if self.telemetry is not None and self.shape == (len(self.axes),):
+            for k, axis in enumerate(self.axes):
+                self.telemetry.write((now, axis, measurement[k], self.setpoint[k], u_sat[k],
+                                      error[k], self.kp[k], self.ki[k], self.kd[k]))
+        return u_sat
+
+    def replay(self, times, measurements):
+        """Run the controller offline over a batch of samples.
+        times: (T,), measurements: (T, *shape) -> outputs (T, *shape)."""
+        measurements = np.asarray(measurements, dtype=float)
+        out = np.empty(measurements.shape)
+        for k in range(len(times)):
+            out[k] = self.compute(measurements[k], timestamp=times[k])
+        return out
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class ConstantVelocityKalman:
+    """Constant-velocity Kalman filter for the agent position.
+
+    Each axis has the state [position, velocity] and the same model, so the
+    axes share one 2x2 covariance. Measurements are (sub-pixel) centroids with
+    the time they were captured; between measurements the state can be
+    predicted to any time, which lets the controller run from the estimate,
+    coast through dropped detections and use a clean velocity for the D term.
+
+    process_noise: white acceleration noise density [px^2/s^3]
+    measurement_noise: centroid variance [px^2]
+    max_coast: how long [s] coast() keeps predicting without a measurement
+    """
+
+    def __init__(self, process_noise=2000.0, measurement_noise=1.0, dims=2, max_coast=0.25):
+        self.q = process_noise
+        self.r = measurement_noise
+        self.dims = dims
+        self.max_coast = max_coast
+        self.reset()
+
+    def reset(self):
+        self.x = np.zeros((2, self.dims))   # row 0: position, row 1: velocity
+        self.P = np.diag([self.r, 1e4])     # velocity unknown until the second measurement
+        self.t = None                       # time of the state
+        self.last_update = None             # time of the last measurement
+
+    @property
+    def initialized(self):
+        return self.t is not None
+
+    @property
+    def position(self):
+        return self.x[0].copy()
+
+    @property
+    def velocity(self):
+        return self.x[1].copy()
+
+    def _propagate(self, x, P, dt):
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.q * np.array([[dt**3 / 3, dt**2 / 2], [dt**2 / 2, dt]])
+        return F @ x, F @ P @ F.T + Q
+
+    def predict(self, timestamp):
+        """(position, velocity) predicted at timestamp, without changing the state."""
+        if not self.initialized:
+            return None, None
+        x, _ = self._propagate(self.x, self.P, max(0.0, timestamp - self.t))
+        return x[0], x[1]
+
+    def update(self, measurement, timestamp):
+        """Fuse a measured position taken at timestamp; returns the filtered position."""
+        z = np.asarray(measurement, dtype=float)
+        if not self.initialized:
+            self.x[0] = z
+            self.t = self.last_update = timestamp
+            return self.position
+
+        dt = max(0.0, timestamp - self.t)
+        self.x, self.P = self._propagate(self.x, self.P, dt)
+
+        # Only the position is measured: H = [1, 0]
+        S = self.P[0, 0] + self.r
+        K = self.P[:, 0] / S
+        self.x = self.x + np.outer(K, z - self.x[0])
+        self.P = self.P - np.outer(K, self.P[0, :])
+
+        self.t = self.last_update = timestamp
+        return self.position
+
+    def coast(self, timestamp):
+        """Advance the state without a measurement (dropped detection). Returns
+        the predicted position, or None (and resets) once max_coast has passed."""
+        if not self.initialized or timestamp - self.last_update > self.max_coast:
+            self.reset()
+            return None
+        self.x, self.P = self._propagate(self.x, self.P, max(0.0, timestamp - self.t))
+        self.t = timestamp
+        return self.position
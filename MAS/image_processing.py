@@ -1,7 +1,20 @@
+import threading
+import time
+from collections import deque, namedtuple
 import cv2
-from picamera2 import Picamera2
-from libcamera import Transform
 import numpy as np
+import profiling
+
+# Pi-only imports: the processing functions also run on a workstation (see replay.py)
+try:
+    from picamera2 import Picamera2
+    from libcamera import Transform
+    ON_PI = True
+except ImportError:
+    ON_PI = False
+
+# A frame from the capture thread: image, capture time (time.monotonic() clock) and sequence number
+CapturedFrame = namedtuple("CapturedFrame", ["image", "timestamp", "seq"])
 
 class CameraBase:
     def read(self):
@@ -11,80 +24,462 @@ class CameraBase:
     def get_frame_size(self):
         raise NotImplementedError
 
+    # ---------------- Orientation (native mode) ----------------
+    # native: frames are unrotated sensor frames of _native_size (width, height)
+    native = False
+    _native_size = None
+
+    def orient(self, frame, copy=False, dst=None):
+        """Display oriented version of a frame from read(). Always a new array
+        if copy=True; with dst the result is written into dst when it has the
+        right shape (use the returned array, dst may be replaced)."""
+        if self.native:
+            return cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE, dst=dst)
+        if dst is not None and dst.shape == frame.shape:
+            np.copyto(dst, frame)
+            return dst
+        return frame.copy() if copy or dst is not None else frame
+
+    def to_display(self, point):
+        # Point in a frame from read() -> point in the display oriented frame
+        if not self.native or point is None:
+            return point
+        x, y = point
+        return (self._native_size[1] - 1 - y, x)
+
+    def to_native(self, point):
+        # Point in the display oriented frame -> point in a frame from read()
+        if not self.native or point is None:
+            return point
+        u, v = point
+        return (v, self._native_size[1] - 1 - u)
+
 class PiCamera(CameraBase):
-    def __init__(self):
+    """Picamera2 wrapper.
+
+    By default read() returns BGR frames rotated 90 degrees clockwise. With
+    native=True the camera is asked for the layout OpenCV uses ("RGB888" is
+    B, G, R in memory) and frames are returned unrotated, so no full frame
+    copies are made before processing. Flips are done by the ISP through the
+    configured Transform; the ISP cannot rotate by 90 degrees, so in native
+    mode use orient() for images shown to the user and to_display() /
+    to_native() to convert point coordinates between the two orientations."""
+
+    def __init__(self, threaded=False, buffer_size=2, native=False, hflip=False, vflip=False,
+                 size=(640, 640)):
+        if not ON_PI:
+            raise RuntimeError("PiCamera needs picamera2 and libcamera")
+        self.native = native
+
+        # Background capture (see start_capture / read_latest)
+        self._frames = deque(maxlen=buffer_size)   # ring buffer of CapturedFrame
+        self._frame_ready = threading.Condition()
+        self._seq = 0
+        self._last_read_seq = 0
+        self.dropped = 0    # frames captured but never returned by read_latest()
+        self._capturing = False
+        self._capture_thread = None
+
         self.picam2 = Picamera2()
+        self.configure(size=size, hflip=hflip, vflip=vflip)
+        self.picam2.start()
+        if threaded:
+            self.start_capture()
+
+    def configure(self, size=(640, 640), hflip=False, vflip=False):
+        """(Re)configure the sensor output. The frame geometry is cached here,
+        so get_frame_size() never has to capture a frame. The capture thread
+        is paused meanwhile and frames of the old geometry are dropped."""
+        capturing = self._capturing
+        self.stop_capture()
+        running = self.picam2.started
+        if running:
+            self.picam2.stop()
         self.picam2.configure(
             self.picam2.create_preview_configuration(
-                main={"format": "BGR888", "size": (640, 640)}
+                main={"format": "RGB888" if self.native else "BGR888", "size": size},
+                transform=Transform(hflip=hflip, vflip=vflip),
             )
         )
-        transform = Transform(vflip=1)
-        self.picam2.start()
+        # (width, height) of the unrotated frame, as actually configured
+        self._native_size = tuple(self.picam2.camera_configuration()["main"]["size"])
+        with self._frame_ready:
+            self._frames.clear()
+        if running:
+            self.picam2.start()
+        if capturing:
+            self.start_capture()
+
+    def _capture(self):
+        request = self.picam2.capture_request()
+        try:
+            frame = request.make_array("main")
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        # SensorTimestamp (ns, CLOCK_BOOTTIME) is when the sensor started the
+        # frame; move it onto the time.monotonic() clock used by the controllers
+        sensor_ns = metadata.get("SensorTimestamp")
+        if sensor_ns is None:
+            timestamp = time.monotonic()
+        else:
+            boot_offset = time.monotonic() - time.clock_gettime(time.CLOCK_BOOTTIME)
+            timestamp = sensor_ns * 1e-9 + boot_offset
+        if not self.native:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+        return frame, timestamp
 
     def read(self):
-        frame = self.picam2.capture_array()
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)   
+        if self._capturing:
+            # Block until the capture thread has a frame we have not seen yet
+            latest = self.read_latest(timeout=1.0)
+            if latest is None:
+                return False, None
+            return True, latest.image
+        frame, _ = self._capture()
         return True, frame
 
+    # ---------------- Threaded capture ----------------
+    def start_capture(self):
+        if self._capturing:
+            return
+        self._capturing = True
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+
+    def stop_capture(self):
+        if not self._capturing:
+            return
+        self._capturing = False
+        self._capture_thread.join(timeout=1.0)
+        self._capture_thread = None
+
+    def _capture_loop(self):
+        while self._capturing:
+            frame, timestamp = self._capture()
+            with self._frame_ready:
+                self._seq += 1
+                self._frames.append(CapturedFrame(frame, timestamp, self._seq))
+                self._frame_ready.notify_all()
+
+    def read_latest(self, timeout=0):
+        """Return the newest CapturedFrame not returned before, or None if there
+        is none. Older unread frames are dropped. With timeout=0 this never
+        blocks; otherwise it waits up to timeout seconds for a new frame."""
+        with self._frame_ready:
+            if timeout:
+                self._frame_ready.wait_for(
+                    lambda: self._frames and self._frames[-1].seq > self._last_read_seq, timeout)
+            if not self._frames or self._frames[-1].seq <= self._last_read_seq:
+                return None
+            latest = self._frames[-1]
+            if self._last_read_seq:
+                self.dropped += latest.seq - self._last_read_seq - 1
+            self._last_read_seq = latest.seq
+            return latest
+
     def release(self):
+        self.stop_capture()
         self.picam2.stop()
 
     def get_frame_size(self):
-        frame = self.picam2.capture_array()
-        h, w = frame.shape[:2]
-        return w, h
+        # Size of the frames returned by read(): legacy frames are rotated by 90 degrees
+        w, h = self._native_size
+        return (w, h) if self.native else (h, w)
+
+
+# Tracker backend of the live loops (main.py, closed_loop.py) and replay.py.
+# "components" gives the pixel centroid of the largest blob (holes included);
+# "contours" uses the moments of its outline polygon. Both are sub-pixel and
+# ignore other blobs; on a 120 px search window they take ~0.06 and ~0.03 ms,
+# small next to the mask (see bench_vision.py)
+TRACK_BACKEND = "components"
+
+# Default HSV threshold for the (dark) agent
+LOWER_BLACK = (0, 0, 0)
+UPPER_BLACK = (180, 255, 95)
+
+
+class MaskPipeline:
+    """Precompiled version of mask(). The ROI mask, structuring elements,
+    threshold arrays and output buffers are built once and reused on every
+    frame through the dst= arguments of the OpenCV calls.
+
+    With crop=True only the bounding rectangle of the ROI (plus a margin for
+    the morphology) is converted, thresholded and cleaned up. The returned
+    mask is then smaller than the frame and self.offset holds the frame
+    coordinates of its top-left corner (pass it on to track())."""
+
+    def __init__(self, roi_points, lower=LOWER_BLACK, upper=UPPER_BLACK,
+                 open_size=5, close_size=11, crop=False):
+        self.roi_points = np.array(roi_points, dtype=np.int32)
+        self.lower = np.array(lower, dtype=np.uint8)
+        self.upper = np.array(upper, dtype=np.uint8)
+        self.kernel_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (open_size, open_size))
+        self.kernel_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (close_size, close_size))
+        self.crop = crop
+        # Open + close can move an edge by at most open_size + close_size pixels,
+        # so this margin keeps the cropped result identical to the full frame one
+        self.margin = open_size + close_size
+
+        # Built lazily from the first frame (and rebuilt if the frame size changes)
+        self.frame_shape = None
+        self.roi_mask = None
+        self.roi_rect = None      # (x, y, w, h) of the ROI plus margin, clipped to the frame
+        self.offset = (0, 0)      # frame coordinates of the last returned mask
+
+    def _configure(self, shape):
+        h, w = shape[:2]
+        self.frame_shape = (h, w)
+        self.roi_mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(self.roi_mask, [self.roi_points], 255)
+
+        x, y, rw, rh = cv2.boundingRect(self.roi_points)
+        self.roi_rect = clip_rect((x - self.margin, y - self.margin,
+                                   rw + 2 * self.margin, rh + 2 * self.margin), (h, w))
+
+        # Buffers are full frame sized; smaller rectangles use views into them
+        self._hsv = np.empty((h, w, 3), dtype=np.uint8)
+        self._thresh = np.empty((h, w), dtype=np.uint8)
+        self._mask = np.empty((h, w), dtype=np.uint8)
+        self._full_mask = np.zeros((h, w), dtype=np.uint8)
+
+    def __call__(self, frame):
+        if frame.shape[:2] != self.frame_shape:
+            self._configure(frame.shape)
+        rect = self.roi_rect if self.crop else (0, 0, self.frame_shape[1], self.frame_shape[0])
+        return self.apply(frame, rect)
+
+    def apply(self, frame, rect):
+        """Mask the (x, y, w, h) rectangle of frame. rect must lie inside the frame."""
+        if frame.shape[:2] != self.frame_shape:
+            self._configure(frame.shape)
+        x, y, w, h = rect
+        src = frame[y:y + h, x:x + w]
+        hsv = self._hsv[:h, :w]
+        thresh = self._thresh[:h, :w]
+        out = self._mask[:h, :w]
+
+        # Masking - Thresholding
+        cv2.cvtColor(src, cv2.COLOR_BGR2HSV, dst=hsv)
+        cv2.inRange(hsv, self.lower, self.upper, dst=thresh)
+
+        # Masking - Combine ROI and Thresholding
+        cv2.bitwise_and(thresh, self.roi_mask[y:y + h, x:x + w], dst=thresh)
+
+        # Masking - Morphological cleanup
+        cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self.kernel_open, dst=out)
+        cv2.morphologyEx(out, cv2.MORPH_CLOSE, self.kernel_close, dst=thresh)
+
+        self.offset = (x, y)
+        # NOTE: the returned array is an internal buffer, overwritten by the next call
+        return thresh
+
+    def full_mask(self, mask):
+        """Paste a mask returned by this pipeline back into a frame sized image (for display)."""
+        if mask.shape[:2] == self.frame_shape:
+            return mask
+        x, y = self.offset
+        h, w = mask.shape[:2]
+        self._full_mask.fill(0)
+        self._full_mask[y:y + h, x:x + w] = mask
+        return self._full_mask
+
+
+def clip_rect(rect, shape):
+    # Clip an (x, y, w, h) rectangle to a frame of the given (h, w, ...) shape
+    x, y, w, h = rect
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(shape[1], x + w), min(shape[0], y + h)
+    return (x0, y0, max(0, x1 - x0), max(0, y1 - y0))
 
 
 # Creates the mask that will be used to calculate the position of the agent 
 def mask(frame, roi_points):
-    # Masking - Region of Interest (ROI)
-    h, w = frame.shape[:2]
-    mask = np.zeros((h, w), dtype=np.uint8)
-    cv2.fillPoly(mask, [np.array(roi_points, dtype=np.int32)], 255)
-    roi_mask = mask
-    
-    # Masking - Thresholding
-    lower_black = (0, 0, 0)
-    upper_black = (180, 255, 95)
-    min_area = 1 
-    hole_fill = True
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, np.array(lower_black), np.array(upper_black))
-    
-    # Masking - Combine ROI and Thresholding
-    if roi_mask is not None:
-        mask = cv2.bitwise_and(mask, roi_mask)
-        
-    # Masking - Morphological cleanup
-    kernel_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    kernel_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (11, 11))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel_open)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel_close) 
-    
-    return mask
+    # One-shot version of MaskPipeline; use a MaskPipeline in loops
+    return MaskPipeline(roi_points)(frame).copy()
 
-def track(mask, min_area):
-    # Find contours
+def track(mask, min_area, offset=(0, 0), backend="contours"):
+    # offset: frame coordinates of the mask's top-left corner (see MaskPipeline.offset)
+    if backend == "components":
+        blob = track_blob(mask, min_area, offset)
+        if blob is None:
+            return None
+        return (int(round(blob["cx"])), int(round(blob["cy"])))
+
+    centroid = track_contour(mask, min_area, offset)
+    if centroid is None:
+        return (0,0) 
+    return (int(round(centroid[0])), int(round(centroid[1])))
+
+def track_contour(mask, min_area, offset=(0, 0)):
+    """Sub-pixel centroid (float x, y) of the largest outer contour with at
+    least min_area pixels, or None. Only that contour's moments are used, so
+    debris elsewhere in the mask does not pull it."""
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     valid = [c for c in contours if cv2.contourArea(c) >= min_area]
     if not valid:
-        return (0,0) 
-    
-    # Determine the largest contour
+        return None
+
+    # Largest contour
     c = max(valid, key=cv2.contourArea)
-    area = cv2.contourArea(c)
-    
-    # Calculate centroid
-    M = cv2.moments(mask)
-    centroid = None
-    if M["m00"] != 0:
-        cx = int(round(M["m10"] / M["m00"]))
-        cy = int(round(M["m01"] / M["m00"]))
-        centroid = (cx, cy)
-
-    return centroid
+    M = cv2.moments(c)
+    if M["m00"] == 0:
+        return None
+    return (M["m10"] / M["m00"] + offset[0], M["m01"] / M["m00"] + offset[1])
+
+# One record per connected blob, in frame coordinates (see find_blobs)
+BLOB_DTYPE = np.dtype([
+    ("area", np.int32),                 # pixel count
+    ("x", np.int32), ("y", np.int32),   # bounding box top-left corner
+    ("w", np.int32), ("h", np.int32),   # bounding box size
+    ("cx", np.float64), ("cy", np.float64),  # sub-pixel centroid
+])
+
+def label_buffer(shape):
+    """Flat label image buffer for find_blobs() on masks of up to shape.
+    16-bit labels are about 3x faster to compute than 32-bit ones and hold
+    every 8-connected blob a mask of this size can have."""
+    blobs_max = ((shape[0] + 1) // 2) * ((shape[1] + 1) // 2)
+    return np.empty(shape[0] * shape[1], dtype=np.uint16 if blobs_max < 65535 else np.int32)
+
+def find_blobs(mask, offset=(0, 0), labels=None):
+    """Stats of every blob in mask from a single connectedComponentsWithStats
+    pass, as a BLOB_DTYPE array (the background is not included).
+    labels: buffer from label_buffer() for the label image, reused instead
+    of allocating one per call."""
+    if labels is None:
+        labels = label_buffer(mask.shape)
+    ltype = cv2.CV_16U if labels.dtype == np.uint16 else cv2.CV_32S
+    n, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+        mask, 8, ltype, cv2.CCL_DEFAULT, labels=labels[:mask.size].reshape(mask.shape))
+    blobs = np.empty(n - 1, dtype=BLOB_DTYPE)
+    blobs["area"] = stats[1:, cv2.CC_STAT_AREA]
+    blobs["x"] = stats[1:, cv2.CC_STAT_LEFT] + offset[0]
+    blobs["y"] = stats[1:, cv2.CC_STAT_TOP] + offset[1]
+    blobs["w"] = stats[1:, cv2.CC_STAT_WIDTH]
+    blobs["h"] = stats[1:, cv2.CC_STAT_HEIGHT]
+    blobs["cx"] = centroids[1:, 0] + offset[0]
+    blobs["cy"] = centroids[1:, 1] + offset[1]
+    return blobs
+
+def largest_blob(blobs, min_area):
+    # Largest blob with at least min_area pixels, or None
+    if len(blobs) == 0:
+        return None
+    i = np.argmax(blobs["area"])
+    if blobs["area"][i] < min_area:
+        return None
+    return blobs[i]
+
+def track_blob(mask, min_area, offset=(0, 0), labels=None):
+    """Like track() but the centroid is that of the largest blob only (so
+    debris elsewhere in the mask does not pull it) and the whole BLOB_DTYPE
+    record is returned, with a sub-pixel centroid. None if no blob is big enough."""
+    return largest_blob(find_blobs(mask, offset, labels), min_area)
+
+class WindowTracker:
+    """Tracks the agent by masking only a small search window around its
+    predicted position (last position + last frame-to-frame motion). Falls
+    back to the whole ROI when the agent is lost or sits on the window edge.
+    Like track(), (0, 0) and None both mean "no agent found"."""
+
+    def __init__(self, pipeline, min_area, window=120, backend="contours", timer=None):
+        self.pipeline = pipeline
+        self.min_area = min_area
+        self.window = window
+        self.backend = backend
+        # "mask" and "track" stage timings (disabled unless a timer is given)
+        self.timer = timer if timer is not None else profiling.StageTimer()
+
+        self.last_pos = None
+        self.velocity = (0, 0)    # pixels per frame
+        self.centroid = None      # sub-pixel centroid of the last find ("components" backend)
+        self.mask = None          # last mask searched (see pipeline.offset / full_mask)
+        self.search_rect = None   # last (x, y, w, h) searched
+        self.full_searches = 0    # number of fallbacks to the whole ROI
+        self._labels = None       # label image buffer ("components" backend)
+
+    def reset(self):
+        self.last_pos = None
+        self.velocity = (0, 0)
+
+    def __call__(self, frame, prediction=None):
+        if frame.shape[:2] != self.pipeline.frame_shape:
+            self.pipeline._configure(frame.shape)
+        roi_rect = self.pipeline.roi_rect
+
+        if prediction is None and self.last_pos is not None:
+            prediction = (self.last_pos[0] + self.velocity[0], self.last_pos[1] + self.velocity[1])
+
+        pos = None
+        if prediction is not None:
+            rect = self._window_rect(prediction, roi_rect)
+            pos = self._search(frame, rect)
+            if pos is not None and self._on_edge(pos, rect, roi_rect):
+                pos = None
+
+        if pos is None:
+            # Lost (or no history yet) - search the whole ROI
+            self.full_searches += 1
+            pos = self._search(frame, roi_rect)
+
+        if pos is None:
+            self.reset()
+            return None
+
+        if self.last_pos is not None:
+            self.velocity = (pos[0] - self.last_pos[0], pos[1] - self.last_pos[1])
+        self.last_pos = pos
+        return pos
+
+    def _window_rect(self, center, roi_rect):
+        half = self.window // 2
+        x, y = int(round(center[0])) - half, int(round(center[1])) - half
+        # Intersect the window with the ROI rectangle
+        rx, ry, rw, rh = roi_rect
+        x0, y0 = max(x, rx), max(y, ry)
+        x1, y1 = min(x + self.window, rx + rw), min(y + self.window, ry + rh)
+        return (x0, y0, max(0, x1 - x0), max(0, y1 - y0))
+
+    def _search(self, frame, rect):
+        self.search_rect = rect
+        if rect[2] == 0 or rect[3] == 0:
+            return None
+        t0 = self.timer.start()
+        self.mask = self.pipeline.apply(frame, rect)
+        self.timer.stop("mask", t0)
+
+        t0 = self.timer.start()
+        if self.backend == "components":
+            if self._labels is None or self._labels.size < self.mask.size:
+                # Sized by the largest mask searched (normally the first, whole ROI search)
+                self._labels = label_buffer(self.mask.shape)
+            blob = track_blob(self.mask, self.min_area, offset=self.pipeline.offset, labels=self._labels)
+            self.timer.stop("track", t0)
+            if blob is None:
+                return None
+            self.centroid = (float(blob["cx"]), float(blob["cy"]))
+            return (int(round(self.centroid[0])), int(round(self.centroid[1])))
+        centroid = track_contour(self.mask, self.min_area, offset=self.pipeline.offset)
+        self.timer.stop("track", t0)
+        if centroid is None:
+            return None
+        self.centroid = centroid
+        return (int(round(centroid[0])), int(round(centroid[1])))
+
+    def _on_edge(self, pos, rect, roi_rect):
+        # True if pos is close to a window edge that is not also an ROI edge,
+        # i.e. part of the agent may lie outside the window
+        edge = self.window // 4
+        x, y, w, h = rect
+        rx, ry, rw, rh = roi_rect
+        return ((pos[0] - x < edge and x > rx) or
+                (x + w - pos[0] < edge and x + w < rx + rw) or
+                (pos[1] - y < edge and y > ry) or
+                (y + h - pos[1] < edge and y + h < ry + rh))
+
 
 def calculate_error(agent_pos, point):
     x_error = agent_pos[0] - point[0]
@@ -2,11 +2,17 @@ import argparse
 import image_processing as ip 
 import movement as mv
 import controllers as ctlr
+import telemetry as tm
+import profiling
 import time
-import os
 
-os.remove("../data/test.csv") if os.path.exists("../data/test.csv") else None
-camera = ip.PiCamera()
+parser = argparse.ArgumentParser()
+parser.add_argument("--profile", action="store_true", help="record per-stage latencies ('p' dumps them)")
+args = parser.parse_args()
+
+timer = profiling.StageTimer(enabled=args.profile)
+log = tm.TelemetryWriter("main")
+camera = ip.PiCamera(threaded=True, native=True)
 ret, first_frame = camera.read()
 if not ret:
     raise RuntimeError("Could not read first frame from PiCamera")
@@ -18,38 +24,60 @@ try:
     # Simulation Configuration
     target = (308, 59)  # Test Position x axis 
     #target = (145, 213)  # Test Position y axis 
-    ctl_x = ctlr.PID("x", kp=4.00, ki=00.0000, kd=0.0000, setpoint=target[0], output_limits=(-60, 60))
-    #ctl_y = ctlr.PID("y", kp=10.8, ki=79.4118, kd=0.3672, setpoint=target[1], output_limits=(-60, 60))
-    
+    ctl_x = ctlr.PID("x", kp=4.00, ki=00.0000, kd=0.0000, setpoint=target[0], output_limits=(-60, 60), telemetry=log)
+    #ctl_y = ctlr.PID("y", kp=10.8, ki=79.4118, kd=0.3672, setpoint=target[1], output_limits=(-60, 60), telemetry=log)
+    roi_points = [(145,59), (470, 59), (145, 379), (470, 379)]
+    mask_pipeline = ip.MaskPipeline(roi_points=[camera.to_native(p) for p in roi_points], crop=True)
+    tracker = ip.WindowTracker(mask_pipeline, min_area=500, backend=ip.TRACK_BACKEND, timer=timer)
 
     while True:
-        ret, frame = camera.read()
-        if not ret:
+        latest = camera.read_latest(timeout=1.0)
+        if latest is None:
             break
+        frame = latest.image
+        step_t0 = timer.start()
+        timer.record("capture", int((time.monotonic() - latest.timestamp) * 1e9))
 
-        comp_mask = ip.mask(frame, roi_points=[(145,59), (470, 59), (145, 379), (470, 379)])
-        pos = ip.track(comp_mask, min_area=500)
+        pos = camera.to_display(tracker(frame))
+        comp_mask = tracker.mask
         if pos is None:
             print("Warning: No valid object found. Skipping frame.")
             continue 
 
         
-        pid_x_out = ctl_x.compute(pos[0])
-        #pid_y_out = ctl_y.compute(pos[1])
+        # dt from the frame timestamps, not from when we got round to computing
+        t0 = timer.start()
+        pid_x_out = ctl_x.compute(pos[0], timestamp=latest.timestamp)
+        #pid_y_out = ctl_y.compute(pos[1], timestamp=latest.timestamp)
+        timer.stop("pid", t0)
 
+        t0 = timer.start()
         x.set_magnetic_field(pid_x_out) 
         #y.set_magnetic_field(pid_y_out) 
+        timer.stop("gpio", t0)
+        timer.stop("step", step_t0)
+
+        t0 = timer.start()
 
+        frame = camera.orient(frame)
         ip.cv2.circle(frame, (target[0], target[1]), radius=5, color=(0, 0, 255), thickness=1)
         ip.cv2.circle(frame, (pos[0], pos[1]), radius=5, color=(255, 0, 0), thickness=1)
         ip.cv2.imshow("Camera Feed", frame)
         #ip.cv2.imshow("Camera Feed", comp_mask)
+        timer.stop("render", t0)
 
+        key = ip.cv2.waitKey(10) & 0xFF
+        if key == ord('p') and timer.enabled:
+            print("\n".join(timer.summary_lines()))
+            print(f"Stage timings written to {timer.dump(time.strftime('../data/%Y%m%d_%Hh%Mm%Ss_timings.json'))}")
         # Exit on ESC
-        if ip.cv2.waitKey(10) & 0xFF == 27:
+        if key == 27:
             break
 finally:
     camera.release()
     x.cleanup()
+    y.cleanup()
     ip.cv2.destroyAllWindows()
+    log.close()
+    print(f"Telemetry written to {log.path}")
     print("Exited cleanly.")
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""Step response metrics, vectorised over runs.
+
+Same quantities as tests/PID_tuner.compute_performance (steady-state error,
+peak time, overshoot, settling time, actuator effort) on NumPy arrays: pos and
+control are (T,) for one run or (T, B) for B runs sharing the time axis (e.g.
+simulated episodes), and every metric comes back as a scalar or a (B,) array.
+
+Overshoot and the settling band are taken relative to the step size
+(setpoint - initial position) rather than to the setpoint's pixel value, and
+the settling time is the time of the last entry into the band: a response
+that passes through the band and leaves it again has not settled yet.
+"""
+import numpy as np
+
+METRICS = ("ess", "peak_time", "overshoot", "settling_time", "effort")
+
+
+def step_metrics(time, pos, control, setpoint, x0=None, tolerance=0.02, band=None):
+    """Metrics of step responses.
+
+    time: (T,); pos, control: (T,) or (T, B); setpoint, x0: scalars or (B,)
+    (x0 defaults to the first position). The settling band is
+    tolerance * |step| or, if band is given, +-band (same units as pos).
+    Times are relative to time[0]; settling_time is NaN if the run ends
+    outside the band."""
+    time = np.asarray(time, dtype=float)
+    pos = np.asarray(pos, dtype=float)
+    control = np.asarray(control, dtype=float)
+    single = pos.ndim == 1
+    if single:
+        pos, control = pos[:, None], control[:, None]
+    t = time - time[0]
+    setpoint = np.asarray(setpoint, dtype=float)
+    x0 = pos[0] if x0 is None else np.asarray(x0, dtype=float)
+
+    step = setpoint - x0
+    direction = np.where(step >= 0, 1.0, -1.0)
+    size = np.maximum(np.abs(step), 1e-12)
+
+    # Steady-state error
+    ess = np.abs(pos[-1] - setpoint)
+
+    # Peak time & overshoot (past the setpoint, in the direction of the step)
+    beyond = direction * (pos - setpoint)
+    peak_idx = np.argmax(beyond, axis=0)
+    peak_time = t[peak_idx]
+    overshoot = np.maximum(beyond.max(axis=0), 0.0) / size * 100
+
+    # Settling time: last entry into the band
+    half_band = tolerance * size if band is None else np.broadcast_to(float(band), size.shape)
+    outside = np.abs(pos - setpoint) > half_band
+    last_out = len(t) - 1 - np.argmax(outside[::-1], axis=0)
+    ever_out = outside.any(axis=0)
+    settled = ~outside[-1]
+    entry = np.where(ever_out, np.minimum(last_out + 1, len(t) - 1), 0)
+    settling_time = np.where(settled, t[entry], np.nan)
+
+    # Actuator effort
+    effort = np.mean(np.abs(control), axis=0)
+
+    out = {"ess": ess, "peak_time": peak_time, "overshoot": overshoot,
+           "settling_time": settling_time, "effort": effort}
+    if single:
+        out = {name: float(np.ravel(value)[0]) for name, value in out.items()}
+    return out
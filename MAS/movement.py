@@ -1,7 +1,10 @@
 import sdl2
 import sys
-import RPi.GPIO as GPIO
+import pwm_backends
 import time
+from coil_driver import CoilDriver
+
+GPIO = pwm_backends.get_backend()  # RPi.GPIO unless MAS_PWM_BACKEND says otherwise
 
 
 class Gamepad:
@@ -142,31 +145,19 @@ class Coil:
         # H-bridge pins: forward/backward for each axis
         self.FWD = FWD # Positive Direction
         self.BWD = BWD # Negative Direction
-    
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-
-        GPIO.setup(self.FWD, GPIO.OUT)
-        GPIO.setup(self.BWD, GPIO.OUT)
 
-        self.pwm_fwd = GPIO.PWM(self.FWD, 1000)
-        self.pwm_bwd = GPIO.PWM(self.BWD, 1000)
-
-        for pwm in [self.pwm_fwd, self.pwm_bwd]:
-            pwm.start(0)
+        # Only duty changes reach the GPIO (see CoilDriver)
+        self.driver = CoilDriver(pwm_freq=1000)
+        self.driver.add_pwm("fwd", self.FWD)
+        self.driver.add_pwm("bwd", self.BWD)
 
     def cleanup(self):
-        for pwm in [self.pwm_fwd, self.pwm_bwd]:
-            pwm.stop()
-        GPIO.cleanup()
-        
+        self.driver.cleanup()
+
     def set_magnetic_field(self, ctl_input):
         if ctl_input > 0:
-            self.pwm_fwd.ChangeDutyCycle(ctl_input)
-            self.pwm_bwd.ChangeDutyCycle(0)
+            self.driver.apply({"fwd": ctl_input, "bwd": 0})
         elif ctl_input < 0:
-            self.pwm_fwd.ChangeDutyCycle(0)
-            self.pwm_bwd.ChangeDutyCycle(abs(ctl_input))
+            self.driver.apply({"fwd": 0, "bwd": abs(ctl_input)})
         else:
-            self.pwm_fwd.ChangeDutyCycle(0)
-            self.pwm_bwd.ChangeDutyCycle(0)
\ No newline at end of file
+            self.driver.apply({"fwd": 0, "bwd": 0})
\ No newline at end of file
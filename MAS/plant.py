@@ -0,0 +1,277 @@
+"""Plant model identification and batch closed-loop simulation.
+
+The agent is dragged through the fluid by the coil field, so under a constant
+duty it settles to a constant velocity (see the openloop_*_max.csv runs): per
+axis the plant is an integrator with a first order velocity lag, dead time,
+a deadband (static friction) and the walls of the workspace,
+
+    tau * v' = gain * dz(u(t - delay)) - v,   x' = v,   lo <= x <= hi
+
+with dz() the deadband and u the signed PWM duty [%]. fit_axis() identifies
+(gain, tau, delay, deadband) from the open loop and closed loop logs in data/;
+simulate_closed_loop() then runs thousands of PID episodes at once as NumPy
+arrays, with the controller's output capped at +-60 % like the rig.
+
+    python3 plant.py                     # fit x and y, save ../data/plant.json
+    python3 plant.py --episodes 5000     # also time a batch of random PID gains
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from collections import namedtuple
+import numpy as np
+import controllers as ctlr
+import runlog
+
+# Duty of the open loop runs (not logged): "_max" runs were at full PWM
+OPENLOOP_DUTY = {"max": 100.0, "limit60": 60.0}
+
+# Search ranges for fit_axis(): (low, high, log scale)
+PARAM_RANGES = {
+    "gain": (0.2, 50.0, True),       # [px/s per % duty]
+    "tau": (0.002, 2.0, True),       # [s]
+    "delay": (0.0, 0.25, False),     # [s]
+    "deadband": (0.0, 30.0, False),  # [% duty]
+}
+
+SimResult = namedtuple("SimResult", ["time", "pos", "u"])
+
+
+class AxisPlant:
+    """Velocity-lag plant of one axis. Parameters are scalars, or arrays of
+    shape (B,) to simulate B different plants at once (used when fitting)."""
+
+    def __init__(self, axis, gain, tau, delay=0.0, deadband=0.0, limits=(None, None), u_max=100.0):
+        self.axis = axis
+        self.gain = np.asarray(gain, dtype=float)
+        self.tau = np.asarray(tau, dtype=float)
+        self.delay = np.asarray(delay, dtype=float)
+        self.deadband = np.asarray(deadband, dtype=float)
+        self.limits = limits
+        self.u_max = u_max  # PWM range; the controller's own cap is output_limits
+
+    def to_dict(self):
+        return {"axis": self.axis, "gain": float(self.gain), "tau": float(self.tau),
+                "delay": float(self.delay), "deadband": float(self.deadband),
+                "limits": list(self.limits), "u_max": self.u_max}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["axis"], d["gain"], d["tau"], d["delay"], d["deadband"],
+                   tuple(d["limits"]), d["u_max"])
+
+    def step(self, x, v, u, dt):
+        """Advance position x and velocity v by dt with the duty u held (exact
+        zero-order hold solution, so dt can be a whole camera frame)."""
+        u = np.clip(u, -self.u_max, self.u_max)
+        drive = self.gain * np.sign(u) * np.maximum(np.abs(u) - self.deadband, 0.0)
+        a = np.exp(-dt / self.tau)
+        x = x + drive * dt + (v - drive) * self.tau * (1.0 - a)
+        v = drive + (v - drive) * a
+
+        # Walls: the agent stops against the edge of the workspace
+        lo, hi = self.limits
+        if lo is not None:
+            v = np.where((x <= lo) & (v < 0), 0.0, v)
+            x = np.maximum(x, lo)
+        if hi is not None:
+            v = np.where((x >= hi) & (v > 0), 0.0, v)
+            x = np.minimum(x, hi)
+        return x, v
+
+
+def _propagate(plant, times, x0, command, batch):
+    """Run plant over the sample times; command(k, x) gives the duty (B,)
+    decided at sample k from the position x at that sample. The command takes
+    effect delay later, rounded to whole samples."""
+    n = len(times)
+    period = float(np.median(np.diff(times))) if n > 1 else 1.0
+    lag = np.broadcast_to(np.rint(plant.delay / period).astype(int), (batch,))
+    history = np.zeros((lag.max() + 1, batch))
+    episodes = np.arange(batch)
+
+    x = np.broadcast_to(np.asarray(x0, dtype=float), (batch,)).copy()
+    v = np.zeros(batch)
+    pos = np.empty((n, batch))
+    u = np.empty((n, batch))
+    for k in range(n):
+        pos[k] = x
+        u[k] = command(k, x)
+        history[k % len(history)] = u[k]
+        if k < n - 1:
+            applied = history[(k - lag) % len(history), episodes]
+            x, v = plant.step(x, v, applied, times[k + 1] - times[k])
+    return pos, u
+
+
+def closed_loop(plant, controller, times, x0, quantize=True, noise=0.0, seed=None):
+    """Closed loop over the sample times with a VectorPID of state shape (B, 1).
+    The controller sees the position as the tracker reports it: rounded to whole
+    pixels (quantize) plus optional Gaussian noise [px]."""
+    rng = np.random.default_rng(seed)
+    batch = controller.shape[0]
+
+    def command(k, x):
+        measured = x + rng.normal(0.0, noise, x.shape) if noise > 0 else x
+        if quantize:
+            measured = np.rint(measured)
+        return controller.compute(measured[:, None], timestamp=times[k])[:, 0]
+
+    controller.reset()
+    return _propagate(plant, times, x0, command, batch)
+
+
+def simulate_closed_loop(plant, kp, ki=0.0, kd=0.0, x0=0.0, setpoint=0.0, duration=5.0, dt=1 / 30,
+                         output_limits=(-60, 60), kaw=0.0, d_filter=0.0, quantize=True,
+                         noise=0.0, seed=None):
+    """Run B closed-loop PID episodes at once: gains, x0 and setpoint are
+    scalars or arrays broadcast to (B,). Returns SimResult with time (T,) and
+    pos, u of shape (T, B)."""
+    batch = np.broadcast_shapes(np.shape(kp), np.shape(ki), np.shape(kd), np.shape(kaw),
+                                np.shape(x0), np.shape(setpoint), (1,))[0]
+    column = lambda a: np.broadcast_to(np.asarray(a, dtype=float), (batch,))[:, None]
+    controller = ctlr.VectorPID((plant.axis,), kp=column(kp), ki=column(ki), kd=column(kd),
+                                setpoint=column(setpoint), output_limits=output_limits,
+                                kaw=column(kaw), d_filter=d_filter)
+    times = np.arange(int(round(duration / dt)) + 1) * dt
+    pos, u = closed_loop(plant, controller, times, np.broadcast_to(x0, (batch,)),
+                         quantize=quantize, noise=noise, seed=seed)
+    return SimResult(times, pos, u)
+
+
+# ---------------- Identification ----------------
+def load_logs(directory, axis):
+    """Step response logs of one axis in directory, as dicts of arrays with
+    "kind" ("open" or "closed") and, for open loop runs, the duty. Samples
+    without a detection (position 0) are dropped."""
+    logs = []
+    for path in sorted(glob.glob(os.path.join(directory, f"openloop_{axis}*.csv"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        duty = next((d for key, d in OPENLOOP_DUTY.items() if name.endswith(key)), None)
+        if duty is None:
+            continue
+        data = runlog.load_axis(path, axis)
+        keep = data["pos"] != 0
+        data = {k: np.asarray(v)[keep] for k, v in data.items()}
+        # Direction of the run from where the agent ended up
+        data["duty"] = duty * np.sign(data["pos"][-1] - data["pos"][0])
+        logs.append(dict(data, kind="open", name=name))
+
+    for path in sorted(glob.glob(os.path.join(directory, f"closedloop_{axis}_*kp.csv"))):
+        data = runlog.load_axis(path, axis)
+        keep = data["pos"] != 0
+        data = {k: np.asarray(v)[keep] for k, v in data.items()}
+        logs.append(dict(data, kind="closed", name=os.path.splitext(os.path.basename(path))[0]))
+    return [log for log in logs if len(log["pos"]) > 2]
+
+
+def _log_cost(plant, log, batch, output_limits):
+    # RMS position error over the run, relative to the distance travelled
+    times = log["time"] - log["time"][0]
+    pos = log["pos"]
+    if log["kind"] == "open":
+        sim, _ = _propagate(plant, times, pos[0], lambda k, x: np.full(batch, log["duty"]), batch)
+    else:
+        shape = (batch, 1)
+        controller = ctlr.VectorPID((plant.axis,), kp=np.full(shape, log["kp"][-1]),
+                                    ki=np.full(shape, log["ki"][-1]), kd=np.full(shape, log["kd"][-1]),
+                                    setpoint=log["setpoint"][-1], output_limits=output_limits)
+        sim, _ = closed_loop(plant, controller, times, pos[0])
+    scale = max(np.ptp(pos), 1.0)
+    return np.sqrt(np.mean((sim - pos[:, None]) ** 2, axis=0)) / scale
+
+
+def fit_axis(logs, axis, limits=None, candidates=1024, rounds=8, output_limits=(-60, 60), seed=0):
+    """Fit (gain, tau, delay, deadband) to the logs by simulating batches of
+    candidate plants and narrowing the search box around the best one each
+    round. Returns (AxisPlant, {log name: relative RMS error})."""
+    rng = np.random.default_rng(seed)
+    if limits is None:
+        every = np.concatenate([log["pos"] for log in logs])
+        limits = (float(every.min()), float(every.max()))
+
+    box = {name: (lo, hi) for name, (lo, hi, _) in PARAM_RANGES.items()}
+    best, best_cost = None, np.inf
+    for _ in range(rounds):
+        params = {}
+        for name, (lo, hi) in box.items():
+            if PARAM_RANGES[name][2]:
+                params[name] = np.exp(rng.uniform(np.log(lo), np.log(hi), candidates))
+            else:
+                params[name] = rng.uniform(lo, hi, candidates)
+        if best is not None:
+            for name in params:
+                params[name][0] = best[name]   # keep the best so far in the batch
+
+        plant = AxisPlant(axis, limits=limits, **params)
+        cost = np.mean([_log_cost(plant, log, candidates, output_limits) for log in logs], axis=0)
+        i = int(np.argmin(cost))
+        if cost[i] < best_cost:
+            best_cost = cost[i]
+            best = {name: float(values[i]) for name, values in params.items()}
+
+        # Shrink the box around the best candidate (in log space where the range is)
+        for name, (lo, hi) in box.items():
+            full_lo, full_hi, log_scale = PARAM_RANGES[name]
+            if log_scale:
+                half = np.log(hi / lo) / 4
+                box[name] = (max(full_lo, best[name] / np.exp(half)), min(full_hi, best[name] * np.exp(half)))
+            else:
+                half = (hi - lo) / 4
+                box[name] = (max(full_lo, best[name] - half), min(full_hi, best[name] + half))
+
+    plant = AxisPlant(axis, limits=limits, **best)
+    errors = {log["name"]: float(_log_cost(plant, log, 1, output_limits)[0]) for log in logs}
+    return plant, errors
+
+
+def save_models(path, plants):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({axis: plant.to_dict() for axis, plant in plants.items()}, f, indent=1)
+
+
+def load_models(path):
+    with open(path, encoding="utf-8") as f:
+        return {axis: AxisPlant.from_dict(d) for axis, d in json.load(f).items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit per-axis plant models and time the batch simulator")
+    parser.add_argument("--data", default="../data", help="directory with the openloop/closedloop logs")
+    parser.add_argument("--axes", nargs="+", default=["x", "y"])
+    parser.add_argument("--out", default="../data/plant.json")
+    parser.add_argument("--episodes", type=int, default=0, help="time this many random closed-loop episodes")
+    args = parser.parse_args()
+
+    plants = {}
+    for axis in args.axes:
+        logs = load_logs(args.data, axis)
+        if not logs:
+            print(f"{axis}: no logs found")
+            continue
+        start = time.perf_counter()
+        plant, errors = fit_axis(logs, axis)
+        plants[axis] = plant
+        p = plant.to_dict()
+        print(f"{axis}: gain {p['gain']:.2f} px/s/%  tau {p['tau'] * 1000:.0f} ms  "
+              f"delay {p['delay'] * 1000:.0f} ms  deadband {p['deadband']:.1f} %  "
+              f"limits {p['limits']}  ({time.perf_counter() - start:.1f} s)")
+        for name, err in errors.items():
+            print(f"    {name:<24} rms error {100 * err:5.1f} % of travel")
+    if plants:
+        save_models(args.out, plants)
+        print(f"Models written to {args.out}")
+
+    if args.episodes and plants:
+        plant = next(iter(plants.values()))
+        rng = np.random.default_rng(0)
+        lo, hi = plant.limits
+        start = time.perf_counter()
+        result = simulate_closed_loop(plant, kp=rng.uniform(0.5, 20, args.episodes),
+                                      ki=rng.uniform(0, 5, args.episodes), kd=rng.uniform(0, 1, args.episodes),
+                                      x0=lo + 20, setpoint=(lo + hi) / 2, duration=5.0)
+        elapsed = time.perf_counter() - start
+        print(f"{args.episodes} episodes x {len(result.time)} steps in {elapsed:.2f} s "
+              f"({args.episodes / elapsed:.0f} episodes/s)")
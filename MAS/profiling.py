@@ -0,0 +1,76 @@
+import json
+import time
+import numpy as np
+
+
+class StageTimer:
+    """Per-stage latency recorder for the control pipeline.
+
+    Usage:
+        t0 = timer.start()
+        ... stage ...
+        timer.stop("mask", t0)
+
+    Each stage keeps its last `size` durations (monotonic ns) in a fixed-size
+    ring array, from which stats() gives rolling p50/p95/p99/max. When the
+    timer is disabled start() and stop() return straight away, so the calls
+    can stay in the loop.
+    """
+
+    def __init__(self, size=1024, enabled=False):
+        self.size = size
+        self.enabled = enabled
+        self._samples = {}   # stage -> int64 ring array of durations [ns]
+        self._count = {}     # stage -> number of samples recorded so far
+
+    def start(self):
+        return time.monotonic_ns() if self.enabled else 0
+
+    def stop(self, stage, t0):
+        # t0 == 0: started while disabled (enabled mid-stage), nothing to record
+        if self.enabled and t0:
+            self.record(stage, time.monotonic_ns() - t0)
+
+    def record(self, stage, duration_ns):
+        if not self.enabled:
+            return
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = np.zeros(self.size, dtype=np.int64)
+            self._count[stage] = 0
+        samples[self._count[stage] % self.size] = duration_ns
+        self._count[stage] += 1
+
+    def reset(self):
+        self._samples.clear()
+        self._count.clear()
+
+    def stats(self):
+        """{stage: {"count", "p50", "p95", "p99", "max"}} with times in ms."""
+        out = {}
+        for stage, samples in list(self._samples.items()):
+            n = min(self._count[stage], self.size)
+            if n == 0:
+                continue
+            p50, p95, p99 = np.percentile(samples[:n], (50, 95, 99)) / 1e6
+            out[stage] = {"count": self._count[stage], "p50": p50, "p95": p95,
+                          "p99": p99, "max": samples[:n].max() / 1e6}
+        return out
+
+    def summary_lines(self):
+        # One line per stage, e.g. for an on-screen overlay
+        return [f"{stage:<9} p50 {s['p50']:6.2f}  p95 {s['p95']:6.2f}  "
+                f"p99 {s['p99']:6.2f}  max {s['max']:6.2f} ms"
+                for stage, s in self.stats().items()]
+
+    def dump(self, path):
+        """Write the stats and the raw rolling samples (ms) to a JSON file."""
+        data = {"stats": self.stats(), "samples_ms": {}}
+        for stage, samples in list(self._samples.items()):
+            n = min(self._count[stage], self.size)
+            # Oldest first
+            order = np.roll(samples, -(self._count[stage] % self.size))[-n:] if n == self.size else samples[:n]
+            data["samples_ms"][stage] = (order / 1e6).tolist()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        return path
@@ -0,0 +1,252 @@
+"""Selectable GPIO / PWM backends.
+
+Every backend exposes the part of the RPi.GPIO API this repo uses (setmode,
+setwarnings, setup, output, PWM(pin, freq) with start / ChangeDutyCycle /
+ChangeFrequency / stop, cleanup and the BCM / OUT / HIGH / LOW constants), so
+a script swaps `import RPi.GPIO as GPIO` for `GPIO = pwm_backends.get_backend()`
+and nothing else changes:
+
+    rpigpio   RPi.GPIO software PWM (default; jitters when the CPU is busy)
+    pigpio    pigpiod DMA-timed PWM (needs `sudo pigpiod`)
+    mock      no hardware; records every write with a timestamp
+
+The backend is picked by the MAS_PWM_BACKEND environment variable (or a
+select() call before the first get_backend()):
+
+    MAS_PWM_BACKEND=pigpio python3 run_me.py
+
+gpiozero scripts call configure_gpiozero() instead, which sets the matching
+gpiozero pin factory from the same variable; when no backend is selected it
+leaves gpiozero's own default (or GPIOZERO_PIN_FACTORY) alone.
+"""
+import atexit
+import os
+import time
+import numpy as np
+
+ENV_VAR = "MAS_PWM_BACKEND"
+DEFAULT_BACKEND = "rpigpio"
+
+_selected = None
+_backends = {}
+
+
+class _GPIOConstants:
+    # Same values as RPi.GPIO
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def setmode(self, mode):
+        if mode != self.BCM:
+            raise ValueError("Only BCM pin numbering is supported")
+
+    def setwarnings(self, flag):
+        pass
+
+
+# ---------------- pigpio ----------------
+class _PigpioPWM:
+    RANGE = 1000    # duty steps: 0.1 %
+
+    def __init__(self, pi, pin, frequency):
+        self.pi = pi
+        self.pin = pin
+        self.frequency = frequency
+
+    def start(self, duty):
+        self.pi.set_PWM_frequency(self.pin, self.frequency)
+        self.pi.set_PWM_range(self.pin, self.RANGE)
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        self.pi.set_PWM_dutycycle(self.pin, int(round(duty * self.RANGE / 100)))
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        self.pi.set_PWM_frequency(self.pin, frequency)
+
+    def stop(self):
+        self.pi.set_PWM_dutycycle(self.pin, 0)
+
+
+class PigpioBackend(_GPIOConstants):
+    """PWM timed by the pigpio daemon's DMA engine instead of a Python thread,
+    so the duty cycle keeps its timing while OpenCV loads the CPU.
+
+    The instance is shared by every driver in the process, so cleanup() only
+    resets pins (as RPi.GPIO does) and the daemon connection is closed once,
+    at exit."""
+
+    def __init__(self):
+        import pigpio
+        self._pigpio = pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("Could not connect to pigpiod (start it with: sudo pigpiod)")
+        self._pins = set()      # pins set up by this process
+        atexit.register(self.pi.stop)
+
+    def setup(self, pin, mode, initial=None):
+        self.pi.set_mode(pin, self._pigpio.OUTPUT if mode == self.OUT else self._pigpio.INPUT)
+        if initial is not None:
+            self.pi.write(pin, initial)
+        self._pins.add(pin)
+
+    def output(self, pins, levels):
+        if isinstance(pins, int):
+            self.pi.write(pins, levels)
+            return
+        if isinstance(levels, int):
+            levels = [levels] * len(pins)
+        # One register write for the pins going high and one for those going low
+        high = sum(1 << pin for pin, level in zip(pins, levels) if level)
+        low = sum(1 << pin for pin, level in zip(pins, levels) if not level)
+        if high:
+            self.pi.set_bank_1(high)
+        if low:
+            self.pi.clear_bank_1(low)
+
+    def PWM(self, pin, frequency):
+        return _PigpioPWM(self.pi, pin, frequency)
+
+    def cleanup(self, channel=None):
+        # Like RPi.GPIO.cleanup(): the given pins (default: all set up here)
+        # stop their PWM and go back to inputs
+        pins = self._pins.copy() if channel is None else {channel} if isinstance(channel, int) else set(channel)
+        for pin in pins & self._pins:
+            self.pi.set_PWM_dutycycle(pin, 0)
+            self.pi.set_mode(pin, self._pigpio.INPUT)
+        self._pins -= pins
+
+
+# ---------------- Mock ----------------
+class _MockPWM:
+    def __init__(self, backend, pin, frequency):
+        self.backend = backend
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0.0
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.backend._record(self.pin, "pwm", duty)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.ChangeDutyCycle(0.0)
+
+
+class MockBackend(_GPIOConstants):
+    """No hardware: every pin write and duty change is recorded in `events` as
+    (time.perf_counter_ns(), pin, "out" | "pwm", value), so the output timing
+    of a script can be measured off the rig (see update_stats())."""
+
+    def __init__(self):
+        self.events = []
+        self.levels = {}    # pin -> last level
+        self.pwms = {}      # pin -> _MockPWM
+
+    def _record(self, pin, kind, value):
+        self.events.append((time.perf_counter_ns(), pin, kind, value))
+
+    def setup(self, pin, mode, initial=None):
+        self.levels[pin] = self.LOW if initial is None else initial
+
+    def output(self, pins, levels):
+        if isinstance(pins, int):
+            pins, levels = [pins], [levels]
+        elif isinstance(levels, int):
+            levels = [levels] * len(pins)
+        for pin, level in zip(pins, levels):
+            self.levels[pin] = level
+            self._record(pin, "out", level)
+
+    def PWM(self, pin, frequency):
+        self.pwms[pin] = _MockPWM(self, pin, frequency)
+        return self.pwms[pin]
+
+    def cleanup(self, channel=None):
+        pass
+
+    def update_stats(self):
+        """{pin: {"updates", "mean_ms", "std_ms", "p99_ms", "max_ms"}} of the
+        intervals between successive duty updates per PWM pin."""
+        stats = {}
+        for pin in self.pwms:
+            t = np.array([e[0] for e in self.events if e[1] == pin and e[2] == "pwm"], dtype=np.int64)
+            if len(t) < 2:
+                continue
+            dt = np.diff(t) / 1e6
+            stats[pin] = {"updates": len(t), "mean_ms": float(dt.mean()), "std_ms": float(dt.std()),
+                          "p99_ms": float(np.percentile(dt, 99)), "max_ms": float(dt.max())}
+        return stats
+
+    def dump(self, path):
+        # time [s from the first event], pin, kind, value
+        t0 = self.events[0][0] if self.events else 0
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(f"{(t - t0) / 1e9:.9f},{pin},{kind},{value}\n" for t, pin, kind, value in self.events)
+        return path
+
+
+# ---------------- Selection ----------------
+def select(name):
+    """Choose the backend for this process (before the first get_backend())."""
+    global _selected
+    if name not in ("rpigpio", "pigpio", "mock"):
+        raise ValueError(f"Unknown PWM backend {name!r} (rpigpio, pigpio or mock)")
+    _selected = name
+
+
+def backend_name():
+    return _selected or os.environ.get(ENV_VAR, DEFAULT_BACKEND)
+
+
+def get_backend(name=None):
+    """The RPi.GPIO-like backend (one shared instance per backend and process)."""
+    name = name or backend_name()
+    if name not in _backends:
+        if name == "rpigpio":
+            import RPi.GPIO
+            _backends[name] = RPi.GPIO
+        elif name == "pigpio":
+            _backends[name] = PigpioBackend()
+        elif name == "mock":
+            _backends[name] = MockBackend()
+        else:
+            raise ValueError(f"Unknown PWM backend {name!r} (rpigpio, pigpio or mock)")
+    return _backends[name]
+
+
+def configure_gpiozero(name=None):
+    """Set gpiozero's pin factory to match the backend and return it.
+
+    Only an explicitly selected backend (name, select() or MAS_PWM_BACKEND)
+    replaces the pin factory; otherwise gpiozero keeps its own default and
+    None is returned."""
+    name = name or _selected or os.environ.get(ENV_VAR)
+    if name is None:
+        return None
+    from gpiozero import Device
+    if name == "pigpio":
+        from gpiozero.pins.pigpio import PiGPIOFactory
+        factory = PiGPIOFactory()
+    elif name == "rpigpio":
+        from gpiozero.pins.rpigpio import RPiGPIOFactory
+        factory = RPiGPIOFactory()
+    elif name == "mock":
+        from gpiozero.pins.mock import MockFactory, MockPWMPin
+        factory = MockFactory(pin_class=MockPWMPin)
+    else:
+        raise ValueError(f"Unknown PWM backend {name!r} (rpigpio, pigpio or mock)")
+    Device.pin_factory = factory
+    return factory
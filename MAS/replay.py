@@ -0,0 +1,224 @@
+"""Headless replay of the vision and control stack on recorded frames.
+
+    python3 replay.py recording.mp4
+    python3 replay.py frames/ --fps 30 --target 308 59 --out replay.csv
+    python3 replay.py frames.npy --profile
+
+Frames come from a video, a directory of images or an .npy stack
+(N x H x W x 3, BGR, in the display orientation, or unrotated sensor frames
+with --native) and go through the control step of closed_loop.py
+(ControlWorker: WindowTracker -> Kalman estimate -> VectorPID). Coil
+commands are recorded by MockCoil instead of driving GPIO, and there is no
+camera or Qt, so this runs on a workstation as fast as the CPU allows. The
+tracker, estimator and controllers are given the recorded frame times, so a
+replay gives the same outputs however fast it runs.
+"""
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+import image_processing as ip
+import control_worker as cw
+import telemetry as tm
+import profiling
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# One row per replayed frame
+RESULT_DTYPE = np.dtype([
+    ("time", "<f8"), ("found", "?"), ("x", "<f8"), ("y", "<f8"),
+    ("out_x", "<f8"), ("out_y", "<f8"),
+])
+
+
+# ---------------- Frame sources ----------------
+def iter_frames(source, fps=30.0):
+    """Yield (frame, timestamp) from a video file, an image directory or an
+    .npy frame stack. Timestamps start at 0; images and .npy stacks have none
+    recorded, so they are spaced at 1/fps."""
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith(IMAGE_EXTENSIONS))
+        for i, name in enumerate(names):
+            frame = cv2.imread(os.path.join(source, name), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError(f"Could not read image {name}")
+            yield frame, i / fps
+    elif source.endswith(".npy"):
+        frames = np.load(source, mmap_mode="r")
+        for i in range(len(frames)):
+            yield np.ascontiguousarray(frames[i]), i / fps
+    else:
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video {source}")
+        try:
+            i = 0
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+                yield frame, (msec / 1000.0 if msec > 0 else i / fps)
+                i += 1
+        finally:
+            cap.release()
+
+
+# ---------------- Mock coil ----------------
+class MockCoil:
+    """Stand-in for movement.Coil that records commands instead of driving GPIO.
+
+    commands holds (time, ctl_input, fwd_duty, bwd_duty) per call, with the
+    duties split the way Coil.set_magnetic_field does it. clock gives the
+    command time (the replay sets it to the frame time)."""
+
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.commands = []
+
+    def set_magnetic_field(self, ctl_input):
+        fwd = ctl_input if ctl_input > 0 else 0
+        bwd = abs(ctl_input) if ctl_input < 0 else 0
+        self.commands.append((self.clock(), ctl_input, fwd, bwd))
+
+    def cleanup(self):
+        pass
+
+    def as_array(self):
+        return np.array(self.commands, dtype=float).reshape(-1, 4)
+
+
+# ---------------- Replay ----------------
+class ReplayCamera(ip.CameraBase):
+    """Stand-in for ip.PiCamera: only the orientation helpers the control
+    loop uses. native=True means the recorded frames are unrotated sensor
+    frames (as ControlWorker sees them); otherwise they are in the display
+    orientation and no conversion is made."""
+
+    def __init__(self, native=False):
+        self.native = native
+
+    def set_frame_shape(self, shape):
+        self._native_size = (shape[1], shape[0])
+
+    def get_frame_size(self):
+        return self._native_size
+
+
+class Replay:
+    """The live control step (control_worker.ControlWorker._step: WindowTracker
+    -> Kalman estimate -> VectorPID -> coils) on frames given one at a time,
+    with MockCoils. ROI, target and path are in display coordinates, as
+    clicked in closed_loop.py; with a path the agent follows its waypoints,
+    otherwise it is held on target."""
+
+    def __init__(self, roi_points, target, path=(), gains_x=(1.0, 0.0, 0.0), gains_y=(5.0, 0.0, 0.0),
+                 min_area=500, backend=ip.TRACK_BACKEND, output_limits=(-60, 60), native=False,
+                 telemetry=None, timer=None):
+        self.roi_points = roi_points
+        self.camera = ReplayCamera(native)
+        self.t = 0.0    # time of the frame being processed
+        self.x_coil = MockCoil("x", clock=lambda: self.t)
+        self.y_coil = MockCoil("y", clock=lambda: self.t)
+
+        self.worker = cw.ControlWorker(self.camera, self.x_coil, self.y_coil, telemetry=telemetry,
+                                       backend=backend)
+        self.worker.clock = lambda: self.t
+        if timer is not None:
+            self.worker.timer = timer
+        self.timer = self.worker.timer
+        ctl = self.worker.ctl
+        ctl.kp[:] = gains_x[0], gains_y[0]
+        ctl.ki[:] = gains_x[1], gains_y[1]
+        ctl.kd[:] = gains_x[2], gains_y[2]
+        ctl.low[:], ctl.high[:] = output_limits
+        self.min_area = min_area
+        self.target = target
+        self.path = list(path)
+        self._seq = 0
+
+    def _begin(self, frame):
+        # The ROI is converted with the frame geometry, so set up on the first frame
+        self.camera.set_frame_shape(frame.shape)
+        self.worker.set_roi(self.roi_points)
+        self.worker.tracker.min_area = self.min_area
+        if self.target is not None:
+            self.worker.set_target(tuple(self.target))
+        self.worker.start(self.path)
+
+    def step(self, frame, timestamp):
+        """Process one frame; returns a RESULT_DTYPE record."""
+        if self.worker.tracker is None:
+            self._begin(frame)
+        self.t = timestamp
+        self._seq += 1
+        sent = len(self.x_coil.commands)
+        self.worker._step(ip.CapturedFrame(frame, timestamp, self._seq))
+        state = self.worker.latest_state()
+
+        result = np.zeros((), dtype=RESULT_DTYPE)
+        result["time"] = timestamp
+        if state.pos is not None:
+            result["found"] = True
+            result["x"], result["y"] = state.pos
+        if len(self.x_coil.commands) > sent:
+            # Commanded on this frame (the coils keep their last command otherwise)
+            result["out_x"] = self.x_coil.commands[-1][1]
+            result["out_y"] = self.y_coil.commands[-1][1]
+        return result
+
+    def run(self, frames):
+        """Replay an iterable of (frame, timestamp); returns a RESULT_DTYPE array."""
+        return np.array([self.step(frame, t) for frame, t in frames], dtype=RESULT_DTYPE)
+
+
+def write_results(path, results):
+    header = ",".join(RESULT_DTYPE.names)
+    np.savetxt(path, np.column_stack([results[name].astype(float) for name in RESULT_DTYPE.names]),
+               delimiter=",", header=header, comments="", fmt="%.6f")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the vision and control stack")
+    parser.add_argument("source", help="video file, image directory or .npy frame stack")
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate for image directories and .npy stacks")
+    parser.add_argument("--roi", type=int, nargs=8, default=[145, 59, 470, 59, 145, 379, 470, 379],
+                        metavar="XY", help="four ROI corners: x1 y1 x2 y2 x3 y3 x4 y4")
+    parser.add_argument("--target", type=float, nargs=2, default=[308, 59], metavar=("X", "Y"))
+    parser.add_argument("--path", type=int, nargs="+", default=[], metavar="XY",
+                        help="waypoints to follow instead of holding the target: x1 y1 x2 y2 ...")
+    parser.add_argument("--native", action="store_true", help="frames are unrotated sensor frames")
+    parser.add_argument("--gains-x", type=float, nargs=3, default=[1.0, 0.0, 0.0], metavar=("KP", "KI", "KD"))
+    parser.add_argument("--gains-y", type=float, nargs=3, default=[5.0, 0.0, 0.0], metavar=("KP", "KI", "KD"))
+    parser.add_argument("--min-area", type=int, default=500)
+    parser.add_argument("--backend", choices=("contours", "components"), default=ip.TRACK_BACKEND)
+    parser.add_argument("--out", help="write per-frame results to this CSV")
+    parser.add_argument("--log", action="store_true", help="write PID telemetry to ../data like a live run")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings")
+    args = parser.parse_args()
+
+    roi_points = list(zip(args.roi[::2], args.roi[1::2]))
+    log = tm.TelemetryWriter("replay") if args.log else None
+    path = list(zip(args.path[::2], args.path[1::2]))
+    replay = Replay(roi_points, args.target, path=path, gains_x=args.gains_x, gains_y=args.gains_y,
+                    min_area=args.min_area, backend=args.backend, native=args.native, telemetry=log,
+                    timer=profiling.StageTimer(enabled=args.profile))
+
+    start = time.perf_counter()
+    results = replay.run(iter_frames(args.source, fps=args.fps))
+    elapsed = time.perf_counter() - start
+    if log is not None:
+        log.close()
+        print(f"Telemetry written to {log.path}")
+
+    n = len(results)
+    print(f"{n} frames, {int(results['found'].sum())} detections, "
+          f"{elapsed:.2f} s ({n / elapsed if elapsed > 0 else 0:.1f} fps)")
+    print(f"Coil commands: x {len(replay.x_coil.commands)}, y {len(replay.y_coil.commands)}")
+    if args.profile:
+        print("\n".join(replay.timer.summary_lines()))
+    if args.out:
+        write_results(args.out, results)
+        print(f"Results written to {args.out}")
@@ -1,10 +1,38 @@
 #!/usr/bin/env python3
-import math
 import threading
 import time
 import sys
 import sdl2
-import RPi.GPIO as GPIO
+import pwm_backends
+from coil_driver import CoilDriver
+import waveforms
+import coil_calibration
+
+GPIO = pwm_backends.get_backend()  # RPi.GPIO unless MAS_PWM_BACKEND says otherwise
+
+# rotation_mode -> (axis driven by sin, axis driven by cos); the third axis is off
+ROTATION_AXES = {
+    "X": ("Y", "Z"),    # Rotate around X (field in YZ)
+    "Y": ("X", "Z"),    # Rotate around Y (field in XZ)
+    "Z": ("X", "Y"),    # Rotate around Z (field in XY)
+    "XY": ("X", "Y"),   # Plane modes
+    "XZ": ("X", "Z"),
+    "YZ": ("Y", "Z"),
+}
+
+# rotation_mode -> sample buffer profile streamed by the WaveformEngine
+# (field rotating in the XZ plane, agent moves along X)
+PROFILES = {
+    "ROLL": waveforms.rolling,
+    "TUMBLE": waveforms.tumbling,
+}
+MODES = ["X", "Y", "Z", "XY", "XZ", "YZ", "ROLL", "TUMBLE"]
+
+# Channels in the calibration's coil order (Z1, Z2, Y3, Y4, X5, X6)
+COIL_CHANNELS = [("Z_DIR1", "Z_PWM1"), ("Z_DIR2", "Z_PWM2"),
+                 ("Y_DIR1", "Y_PWM1"), ("Y_DIR2", "Y_PWM2"),
+                 ("X_DIR1", "X_PWM1"), ("X_DIR2", "X_PWM2")]
+
 
 class MDD10A_DualCoilController:
     """
@@ -30,44 +58,35 @@ class MDD10A_DualCoilController:
         # PWM frequency
         self.PWM_FREQ = 1000  # Hz
 
-        # GPIO setup
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        for pin in self.PINS.values():
-            GPIO.setup(pin, GPIO.OUT)
-
-        # Create PWM objects
-        self.pwm = {
-            "X1": GPIO.PWM(self.PINS["X_PWM1"], self.PWM_FREQ),
-            "X2": GPIO.PWM(self.PINS["X_PWM2"], self.PWM_FREQ),
-            "Y1": GPIO.PWM(self.PINS["Y_PWM1"], self.PWM_FREQ),
-            "Y2": GPIO.PWM(self.PINS["Y_PWM2"], self.PWM_FREQ),
-            "Z1": GPIO.PWM(self.PINS["Z_PWM1"], self.PWM_FREQ),
-            "Z2": GPIO.PWM(self.PINS["Z_PWM2"], self.PWM_FREQ),
-        }
-        for p in self.pwm.values():
-            p.start(0)
+        # GPIO setup: every channel goes through the write-coalescing driver,
+        # so only direction / duty changes reach the hardware
+        self.driver = CoilDriver(pwm_freq=self.PWM_FREQ)
+        for name, pin in self.PINS.items():
+            if "_DIR" in name:
+                self.driver.add_pin(name, pin)
+            else:
+                self.driver.add_pwm(name, pin)
 
-        self.dir_pins = {
-            "X": (self.PINS["X_DIR1"], self.PINS["X_DIR2"]),
-            "Y": (self.PINS["Y_DIR1"], self.PINS["Y_DIR2"]),
-            "Z": (self.PINS["Z_DIR1"], self.PINS["Z_DIR2"]),
-        }
-
-        self.pwm_pairs = {
-            "X": (self.pwm["X1"], self.pwm["X2"]),
-            "Y": (self.pwm["Y1"], self.pwm["Y2"]),
-            "Z": (self.pwm["Z1"], self.pwm["Z2"]),
-        }
+        # Channel names per axis
+        self.dir_pins = {axis: (f"{axis}_DIR1", f"{axis}_DIR2") for axis in ("X", "Y", "Z")}
+        self.pwm_pairs = {axis: (f"{axis}_PWM1", f"{axis}_PWM2") for axis in ("X", "Y", "Z")}
 
         # Rotation parameters
         self.MAX_PWM = 60.0
         self.B_amplitude = 20.0
+        self.B_field = 0.3  # mT, ROLL / TUMBLE amplitude (through the coil calibration)
         self.rotation_freq = 0.0
         self.rotation_mode = "XY"
         self.direction = 1  # +1 CCW, -1 CW
         self.rotating = False
         self.rotation_thread = None
+        self.UPDATE_RATE = 1000  # Hz, field updates
+        self.oscillator = waveforms.PhaseAccumulator(self.UPDATE_RATE)
+        self.calibration = coil_calibration.Calibration(coil_calibration.M1, coil_calibration.b1,
+                                                        coil_calibration.M2, coil_calibration.b2,
+                                                        pwm_limit=self.MAX_PWM)
+        self.engine = waveforms.WaveformEngine(self.set_coils, self.UPDATE_RATE,
+                                               calibration=self.calibration)
 
         # Joystick setup
         sdl2.SDL_Init(sdl2.SDL_INIT_JOYSTICK)
@@ -83,78 +102,57 @@ class MDD10A_DualCoilController:
         self.BTN_MODE   = 1  # cycle modes
 
     # ---------------- Low-level axis control ----------------
-    def _apply_axis(self, axis, duty_percent):
-        if axis not in ("X", "Y", "Z"):
-            return
-
+    def _axis_updates(self, axis, duty_percent):
+        # Channel values for one axis (both channels driven identically)
         dir1, dir2 = self.dir_pins[axis]
         pwm1, pwm2 = self.pwm_pairs[axis]
         mag = min(abs(duty_percent), self.MAX_PWM)
+        level = GPIO.HIGH if duty_percent > 0 else GPIO.LOW
+        return {dir1: level, dir2: level, pwm1: mag, pwm2: mag}
 
-        if duty_percent > 0:
-            GPIO.output(dir1, GPIO.HIGH)
-            GPIO.output(dir2, GPIO.HIGH)
-            pwm1.ChangeDutyCycle(mag)
-            pwm2.ChangeDutyCycle(mag)
-        elif duty_percent < 0:
-            GPIO.output(dir1, GPIO.LOW)
-            GPIO.output(dir2, GPIO.LOW)
-            pwm1.ChangeDutyCycle(mag)
-            pwm2.ChangeDutyCycle(mag)
-        else:
-            pwm1.ChangeDutyCycle(0)
-            pwm2.ChangeDutyCycle(0)
-            GPIO.output(dir1, GPIO.LOW)
-            GPIO.output(dir2, GPIO.LOW)
+    def _apply_axis(self, axis, duty_percent):
+        if axis not in ("X", "Y", "Z"):
+            return
+        self.driver.apply(self._axis_updates(axis, duty_percent))
 
     def set_field(self, bx, by, bz):
-        self._apply_axis("X", bx)
-        self._apply_axis("Y", by)
-        self._apply_axis("Z", bz)
+        # All three axes in one batch
+        updates = self._axis_updates("X", bx)
+        updates.update(self._axis_updates("Y", by))
+        updates.update(self._axis_updates("Z", bz))
+        self.driver.apply(updates)
+
+    def set_coils(self, *duties):
+        # Per-coil duty cycles [%] in COIL_CHANNELS order, one batch
+        updates = {}
+        for (dir_name, pwm_name), duty in zip(COIL_CHANNELS, duties):
+            updates[dir_name] = GPIO.HIGH if duty > 0 else GPIO.LOW
+            updates[pwm_name] = min(abs(duty), self.MAX_PWM)
+        self.driver.apply(updates)
 
     # ---------------- Rotation Generator ----------------
     def rotate_field(self):
-        t0 = time.time()
+        # Phase-continuous oscillator (sine table) on absolute deadlines
+        ticker = waveforms.Ticker(1.0 / self.UPDATE_RATE)
+        steps = 0
         while self.rotating:
-            t = time.time() - t0
-            omega = 2 * math.pi * self.rotation_freq * self.direction
-            B = self.B_amplitude
-
-            bx = by = bz = 0.0
-
-            # --- TRUE rotation about axes ---
-            if self.rotation_mode == "X":  # Rotate around X (field in YZ)
-                bx = 0.0
-                by = B * math.sin(omega * t)
-                bz = B * math.cos(omega * t)
-
-            elif self.rotation_mode == "Y":  # Rotate around Y (field in XZ)
-                bx = B * math.sin(omega * t)
-                by = 0.0
-                bz = B * math.cos(omega * t)
-
-            elif self.rotation_mode == "Z":  # Rotate around Z (field in XY)
-                bx = B * math.sin(omega * t)
-                by = B * math.cos(omega * t)
-                bz = 0.0
-
-            elif self.rotation_mode == "XY":  # Plane mode
-                bx = B * math.sin(omega * t)
-                by = B * math.cos(omega * t)
-                bz = 0.0
-
-            elif self.rotation_mode == "XZ":  # Plane mode
-                bx = B * math.sin(omega * t)
-                by = 0.0
-                bz = B * math.cos(omega * t)
-
-            elif self.rotation_mode == "YZ":  # Plane mode
-                bx = 0.0
-                by = B * math.sin(omega * t)
-                bz = B * math.cos(omega * t)
-
-            self.set_field(bx, by, bz)
-            time.sleep(0.001)
+            self.oscillator.frequency = self.rotation_freq * self.direction
+            s, c = self.oscillator.advance(steps)
+
+            field = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+            axes = ROTATION_AXES.get(self.rotation_mode)
+            if axes is not None:
+                field[axes[0]] = self.B_amplitude * s
+                field[axes[1]] = self.B_amplitude * c
+
+            self.set_field(field["X"], field["Y"], field["Z"])
+            steps = ticker.wait()
+        print(f"\nField updates: {ticker.summary()}")
+
+    def _profile_buffer(self):
+        # One period of the ROLL / TUMBLE field [mT] at the current frequency
+        return PROFILES[self.rotation_mode](self.UPDATE_RATE, self.rotation_freq * self.direction,
+                                            self.B_field)
 
     def start_rotation(self):
         if self.rotating:
@@ -162,6 +160,12 @@ class MDD10A_DualCoilController:
         print(f"\nStarting rotation: mode={self.rotation_mode}, dir={'CCW' if self.direction>0 else 'CW'}, "
               f"freq={self.rotation_freq:.2f} Hz")
         self.rotating = True
+        if self.rotation_mode in PROFILES:
+            self.engine.load(self._profile_buffer(), period=True)
+            if self.engine.saturated:
+                print(f"Warning: {self.engine.saturated} samples exceed {self.MAX_PWM:.0f}% duty (clipped)")
+            self.engine.start()
+            return
         self.rotation_thread = threading.Thread(target=self.rotate_field, daemon=True)
         self.rotation_thread.start()
 
@@ -170,10 +174,14 @@ class MDD10A_DualCoilController:
             return
         print("\nStopping rotation...")
         self.rotating = False
+        if self.engine.running:
+            self.engine.stop()
+            print(f"Field updates: {self.engine.stats()}")
         if self.rotation_thread:
             self.rotation_thread.join(timeout=1.0)
             self.rotation_thread = None
         self.set_field(0.0, 0.0, 0.0)
+        print(self.driver.stats())
 
     # ---------------- Controller / SDL ----------------
     def poll_controller(self):
@@ -191,10 +199,13 @@ class MDD10A_DualCoilController:
                         self.stop_rotation()
 
                 elif btn == self.BTN_MODE:
-                    modes = ["X", "Y", "Z", "XY", "XZ", "YZ"]
-                    idx = modes.index(self.rotation_mode) if self.rotation_mode in modes else 0
-                    self.rotation_mode = modes[(idx + 1) % len(modes)]
+                    idx = MODES.index(self.rotation_mode) if self.rotation_mode in MODES else 0
+                    previous, self.rotation_mode = self.rotation_mode, MODES[(idx + 1) % len(MODES)]
                     print(f"\nMode -> {self.rotation_mode}")
+                    if self.rotating and (previous in PROFILES or self.rotation_mode in PROFILES):
+                        # Switch between the oscillator thread and the engine
+                        self.stop_rotation()
+                        self.start_rotation()
 
             elif event.type == sdl2.SDL_JOYAXISMOTION:
                 if event.jaxis.axis == 1:  # Left stick Y-axis
@@ -202,6 +213,8 @@ class MDD10A_DualCoilController:
                     # Frequency proportional to magnitude, direction from sign
                     self.direction = 1 if val >= 0 else -1
                     self.rotation_freq = max(0.05, min(10.0, abs(val) * 10.0))
+                    if self.engine.running:
+                        self.engine.load(self._profile_buffer(), period=True)   # swapped in at the same phase
                     print(f"\rFreq: {self.rotation_freq:.2f} Hz, Dir: {'CCW' if self.direction>0 else 'CW'}",
                           end="", flush=True)
 
@@ -213,22 +226,7 @@ class MDD10A_DualCoilController:
     # ---------------- Cleanup ----------------
     def cleanup(self):
         self.stop_rotation()
-        for p in self.pwm.values():
-            try:
-                p.ChangeDutyCycle(0)
-                p.stop()
-            except Exception:
-                pass
-
-        for axis in ("X", "Y", "Z"):
-            d1, d2 = self.dir_pins[axis]
-            try:
-                GPIO.output(d1, GPIO.LOW)
-                GPIO.output(d2, GPIO.LOW)
-            except Exception:
-                pass
-
-        GPIO.cleanup()
+        self.driver.cleanup()
         try:
             sdl2.SDL_Quit()
         except Exception:
@@ -242,13 +240,15 @@ if __name__ == "__main__":
         print("\nHelmholtz Coil Controller")
         print("--------------------------")
         print(" A  -> Toggle rotation start/stop")
-        print(" B  -> Cycle rotation axis (X, Y, Z, XY, XZ, YZ)")
+        print(" B  -> Cycle rotation axis (X, Y, Z, XY, XZ, YZ, ROLL, TUMBLE)")
         print(" Left stick Y -> Adjust frequency and direction")
         print("\nModes:")
         print("  X  = Rotate around X axis (field in YZ plane)")
         print("  Y  = Rotate around Y axis (field in XZ plane)")
         print("  Z  = Rotate around Z axis (field in XY plane)")
-        print("  XY, XZ, YZ = direct plane modes for testing\n")
+        print("  XY, XZ, YZ = direct plane modes for testing")
+        print("  ROLL   = field rotating in the XZ plane (rolls along X)")
+        print("  TUMBLE = as ROLL, dwelling near horizontal (flips end over end)\n")
 
         while True:
             controller.poll_controller()
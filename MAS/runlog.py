@@ -0,0 +1,172 @@
+"""Compact binary run format for control loop logs.
+
+A .run file is laid out as:
+
+    b"MASRUN1\\n"                  magic
+    uint32 (little endian)        length of the JSON header
+    JSON header                   rows, columns (name, dtype, offset), axes, gains, target
+    column blocks                 one contiguous array per column, 64 byte aligned
+
+Rows are grouped by axis (keeping time order within an axis), so the header's
+"axes" entry maps each axis to a [start, stop) row range and a per-axis load is
+a slice of memory mapped columns: no text parsing and no dependence on the row
+order of the original CSV.
+
+The CSV schema is the one written by controllers.PID.log():
+    time, axis, pos, setpoint, ctrl_out, error, kp, ki, kd
+"""
+import argparse
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"MASRUN1\n"
+ALIGN = 64
+
+CSV_COLUMNS = ("time", "axis", "pos", "setpoint", "ctrl_out", "error", "kp", "ki", "kd")
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"), ("axis", "S1"), ("pos", "<f8"), ("setpoint", "<f8"),
+    ("ctrl_out", "<f8"), ("error", "<f8"), ("kp", "<f8"), ("ki", "<f8"), ("kd", "<f8"),
+])
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+# ---------------- CSV ----------------
+def read_csv(path):
+    """Headerless run CSV -> RECORD_DTYPE array (in file order)."""
+    csv_dtype = [(name, "U1" if name == "axis" else "<f8") for name in CSV_COLUMNS]
+    rows = np.loadtxt(path, delimiter=",", dtype=csv_dtype, ndmin=1)
+    return rows.astype(RECORD_DTYPE)
+
+
+def write_csv(path, records):
+    """RECORD_DTYPE array -> headerless run CSV, in time order."""
+    records = records[np.argsort(records["time"], kind="stable")]
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            fields = [repr(float(r[name])) if name != "axis" else r[name].decode()
+                      for name in CSV_COLUMNS]
+            f.write(",".join(fields) + "\n")
+
+
+# ---------------- Binary ----------------
+def write_run(path, records, **meta):
+    """Write RECORD_DTYPE records as a .run file. Extra keyword arguments are
+    stored in the header (e.g. source="initial_y.csv")."""
+    records = np.asarray(records, dtype=RECORD_DTYPE)
+    order = np.lexsort((records["time"], records["axis"]))  # by axis, then time
+    records = records[order]
+
+    axes, gains, target = {}, {}, {}
+    names, starts = np.unique(records["axis"], return_index=True)
+    stops = list(starts[1:]) + [len(records)]
+    for name, start, stop in zip(names, starts, stops):
+        axis = name.decode()
+        last = records[stop - 1]
+        axes[axis] = [int(start), int(stop)]
+        gains[axis] = {"kp": float(last["kp"]), "ki": float(last["ki"]), "kd": float(last["kd"])}
+        target[axis] = float(last["setpoint"])
+
+    header = {"rows": len(records), "columns": [], "axes": axes, "gains": gains,
+              "target": target, **meta}
+
+    # Column offsets depend on the header size, which depends on the offsets:
+    # start from a guess and grow it until the header fits before the data
+    data_start = _align(len(MAGIC) + 4 + len(json.dumps(header)))
+    while True:
+        header["columns"] = []
+        offset = data_start
+        for name in RECORD_DTYPE.names:
+            dtype = RECORD_DTYPE[name]
+            header["columns"].append({"name": name, "dtype": dtype.str, "offset": offset})
+            offset = _align(offset + dtype.itemsize * len(records))
+        blob = json.dumps(header).encode("utf-8")
+        if len(MAGIC) + 4 + len(blob) <= data_start:
+            break
+        data_start = _align(len(MAGIC) + 4 + len(blob))
+    blob = blob.ljust(data_start - len(MAGIC) - 4)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(blob)))
+        f.write(blob)
+        for col in header["columns"]:
+            f.seek(col["offset"])
+            f.write(np.ascontiguousarray(records[col["name"]]).tobytes())
+        f.truncate(max(offset, data_start))
+
+
+class Run:
+    """A .run file opened with memory mapped columns."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a run file")
+            (n,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(n))
+
+        rows = self.header["rows"]
+        self.columns = {}
+        for col in self.header["columns"]:
+            if rows == 0:
+                self.columns[col["name"]] = np.empty(0, dtype=col["dtype"])
+            else:
+                self.columns[col["name"]] = np.memmap(path, dtype=col["dtype"], mode="r",
+                                                      offset=col["offset"], shape=(rows,))
+
+    @property
+    def axes(self):
+        return list(self.header["axes"])
+
+    def axis(self, name):
+        """Dict of column name -> array (views, no copy) for one axis, in time order."""
+        start, stop = self.header["axes"][name]
+        return {col: values[start:stop] for col, values in self.columns.items() if col != "axis"}
+
+    def records(self):
+        # All rows as a RECORD_DTYPE array (grouped by axis)
+        out = np.empty(self.header["rows"], dtype=RECORD_DTYPE)
+        for name, values in self.columns.items():
+            out[name] = values
+        return out
+
+
+def load_run(path):
+    return Run(path)
+
+
+def load_axis(path, axis):
+    """Per-axis arrays from a .run file (memory mapped) or a legacy CSV (parsed)."""
+    if path.endswith(".run"):
+        return Run(path).axis(axis)
+    records = read_csv(path)
+    records = records[records["axis"] == axis.encode()]
+    return {name: records[name] for name in RECORD_DTYPE.names if name != "axis"}
+
+
+# ---------------- Converters ----------------
+def csv_to_run(csv_path, run_path=None):
+    run_path = run_path or os.path.splitext(csv_path)[0] + ".run"
+    write_run(run_path, read_csv(csv_path), source=os.path.basename(csv_path))
+    return run_path
+
+
+def run_to_csv(run_path, csv_path=None):
+    csv_path = csv_path or os.path.splitext(run_path)[0] + ".csv"
+    write_csv(csv_path, Run(run_path).records())
+    return csv_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert run logs between CSV and the binary .run format")
+    parser.add_argument("files", nargs="+", help=".csv files are converted to .run and vice versa")
+    args = parser.parse_args()
+    for path in args.files:
+        out = run_to_csv(path) if path.endswith(".run") else csv_to_run(path)
+        print(f"{path} -> {out}")
@@ -0,0 +1,82 @@
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class TelemetryWriter:
+    """Buffered, asynchronous CSV writer for control loop records.
+
+    write() only puts the record on a bounded in-memory queue, so it never
+    blocks or touches the disk on the control path; if the queue is full the
+    record is dropped and counted. A background thread formats the records in
+    batches and flushes them every flush_interval seconds.
+
+    Every writer logs to its own file: <directory>/<YYYYmmdd_HHhMMmSSs>_<name>.csv,
+    or <..>_<name>_2.csv, _3, ... when writers start within the same second.
+    The file is created exclusively, so a writer never appends to another's.
+    """
+
+    def __init__(self, name="run", directory="../data", max_queue=100000,
+                 flush_interval=0.5, batch_size=1000):
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%Hh%Mm%Ss")
+        base = os.path.join(directory, f"{stamp}_{name}")
+        self.path, n = base + ".csv", 1
+        while True:
+            try:
+                self._file = open(self.path, "x", encoding="utf-8")
+                break
+            except FileExistsError:
+                n += 1
+                self.path = f"{base}_{n}.csv"
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0    # records lost because the queue was full
+        self.written = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        """Queue one record (a tuple of CSV fields). Never blocks."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Write out everything queued so far and stop the writer thread
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        with self._file as f:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    batch = []
+                while batch and batch[-1] is not _STOP and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = bool(batch) and batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                f.writelines(",".join(map(str, record)) + "\n" for record in batch)
+                self.written += len(batch)
+
+                now = time.monotonic()
+                if stop or now - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = now
+                if stop:
+                    return
@@ -1,32 +1,25 @@
-import numpy as np
+import glob
+import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import metrics  # MAS/metrics.py
 
-def compute_performance(time, pos, control, steady_state_value, tolerance=0.02):
-    # Steady-state error
-    Ess = abs(pos.iloc[-1] - steady_state_value)
-
-    # Peak time & overshoot
-    peak_idx = pos.idxmax()
-    Tp = time.iloc[peak_idx]
-    peak_value = pos.iloc[peak_idx]
-    overshoot = ((peak_value - steady_state_value) / steady_state_value * 100
-                 if steady_state_value != 0 else np.nan)
-
-    # Settling time
-    settling_mask = (abs(pos - steady_state_value) <= tolerance * abs(steady_state_value))
-    Ts = time[settling_mask.idxmax()] if settling_mask.any() else np.nan
 
-    # Actuator effort
-    actuator_effort = np.mean(abs(control))
+def compute_performance(time, pos, control, steady_state_value, tolerance=0.02):
+    # Vectorised metrics shared with analytics.py / tune.py: overshoot and the
+    # settling band are relative to the step, Ts is the last entry into the band
+    m = metrics.step_metrics(time.to_numpy(), pos.to_numpy(), control.to_numpy(),
+                             steady_state_value, tolerance=tolerance)
 
     return {
-        "Steady-State Error (Ess)": Ess,
-        "Peak Time (Tp)": Tp,
-        "Overshoot (%)": overshoot,
-        "Settling Time (Ts)": Ts,
-        "Actuator Effort": actuator_effort
+        "Steady-State Error (Ess)": m["ess"],
+        "Peak Time (Tp)": m["peak_time"],
+        "Overshoot (%)": m["overshoot"],
+        "Settling Time (Ts)": m["settling_time"],
+        "Actuator Effort": m["effort"]
     }
 
 
@@ -83,38 +76,50 @@ def load_axis_data(file_path, axis="x"):
     df.columns = ['Time', 'Axis', 'Position', 'Set Point',
                   'Control Output', 'Error', 'Kp', 'Ki', 'Kd']
 
-    # Time offset correction
-    x_time_0 = df.iat[0, 0]
-    y_time_0 = df.iat[1, 0]
-    df.iloc[::2, 0] -= x_time_0
-    df.iloc[1::2, 0] -= y_time_0
-
-    if axis.lower() == "x":
-        time = df['Time'][::2].reset_index(drop=True)
-        pos = df['Position'][::2].reset_index(drop=True)
-        control = df['Control Output'][::2].reset_index(drop=True)
-        steady_state_value = df['Set Point'][::2].iloc[-1]
-    elif axis.lower() == "y":
-        time = df['Time'][1::2].reset_index(drop=True)
-        pos = df['Position'][1::2].reset_index(drop=True)
-        control = df['Control Output'][1::2].reset_index(drop=True)
-        steady_state_value = df['Set Point'][1::2].iloc[-1]
-    else:
+    # Rows of this axis (logs can hold one or both axes, in any order)
+    if axis.lower() not in ("x", "y"):
         raise ValueError("Axis must be 'x' or 'y'")
+    df = df[df['Axis'] == axis.lower()].sort_values('Time', kind='stable').reset_index(drop=True)
+    if df.empty:
+        raise ValueError(f"No {axis} rows in {file_path}")
 
-    return time, pos, control, steady_state_value
-
-# Load X-axis data
-time_x, pos_x, control_x, sp_x = load_axis_data("../data/test.csv", axis="x")
-time_y, pos_y, control_y, sp_y = load_axis_data("../data/test.csv", axis="y")
+    # Time offset correction
+    time = df['Time'] - df['Time'].iloc[0]
+    pos = df['Position']
+    control = df['Control Output']
+    steady_state_value = df['Set Point'].iloc[-1]
 
-# Compute metrics
-metrics_x = compute_performance(time_x, pos_x, control_x, sp_x)
-metrics_y = compute_performance(time_y, pos_y, control_y, sp_y)
+    return time, pos, control, steady_state_value
 
-# Plot response
-plot_response(time_x, pos_x, control_x, sp_x, metrics_x, axis="x")
-#plot_response(time_y, pos_y, control_y, sp_y, metrics_y, axis="y")
+def latest_log(directory):
+    # Newest run CSV in data/ (telemetry names them by start time)
+    logs = glob.glob(os.path.join(directory, "*.csv"))
+    if not logs:
+        raise SystemExit(f"No run logs in {directory}; pass one: python3 PID_tuner.py <log.csv>")
+    return max(logs, key=os.path.getmtime)
+
+
+# Run log to analyse (python3 PID_tuner.py <log.csv>; default: newest in data/;
+# analytics.py summarises all of data/)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+log_path = sys.argv[1] if len(sys.argv) > 1 else latest_log(DATA_DIR)
+print(f"Analysing {log_path}")
+
+for axis in ("x", "y"):
+    # Load this axis' data (a log may hold only one axis)
+    try:
+        time_a, pos_a, control_a, sp_a = load_axis_data(log_path, axis=axis)
+    except ValueError as e:
+        print(e)
+        continue
+
+    # Compute metrics
+    metrics_a = compute_performance(time_a, pos_a, control_a, sp_a)
+    for name, value in metrics_a.items():
+        print(f"  {axis}: {name}: {value:.3f}")
+
+    # Plot response
+    plot_response(time_a, pos_a, control_a, sp_a, metrics_a, axis=axis)
 
 
 """
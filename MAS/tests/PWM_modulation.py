@@ -1,3 +1,4 @@
+import os
 import sys
 import numpy as np
 from PyQt5.QtWidgets import (
@@ -9,6 +10,12 @@ import time
 from gpiozero import PWMOutputDevice, OutputDevice, Device
 import math
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pwm_backends  # MAS/pwm_backends.py
+import waveforms  # MAS/waveforms.py
+import coil_calibration  # MAS/coil_calibration.py
+pwm_backends.configure_gpiozero()  # pin factory from MAS_PWM_BACKEND
+
 # GPIO Mock as before (omitted here for brevity)...
 
 class PWMControlApp(QWidget):
@@ -119,10 +126,10 @@ f_x = float(input("Frequency - X: "))
 f_y = float(input("Frequency - Y: "))
 f_z = float(input("Frequency - Z: "))
 
-print("\nCoil Current (Amplitude: 0.0 to 1.0)")
-i_x = float(input("Current - X: "))
-i_y = float(input("Current - Y: "))
-i_z = float(input("Current - Z: "))
+print("\nField Amplitude (mT)")
+b_x = float(input("Field - X: "))
+b_y = float(input("Field - Y: "))
+b_z = float(input("Field - Z: "))
 
 print("\nCoil Phase (degrees)")
 phi_x = float(input("Phase - X: "))
@@ -154,37 +161,30 @@ for device in [DIR_Z1, DIR_Z2, DIR_Y3, DIR_Y4, DIR_X5, DIR_X6]:
     device.frequency = 5000
 
 # --- PWM CONTROL LOOP ---
-print("\nRunning PWM modulation. Press Ctrl+C to stop.\n")
-try:
-    start_time = time.time()
-    while True:
-        t = time.time() - start_time
-
-        # Compute sinusoidal PWM values (centered at 0.5)
-        pwm_x = 0.5 + i_x * math.sin(2 * math.pi * f_x * t + phi_x) / 2
-        pwm_y = 0.5 + i_y * math.sin(2 * math.pi * f_y * t + phi_y) / 2
-        pwm_z = 0.5 + i_z * math.sin(2 * math.pi * f_z * t + phi_z) / 2
+UPDATE_RATE = 1000  # Hz, field updates
 
-        # Clamp values between 0 and 1 (safety)
-        pwm_x = max(0.0, min(1.0, pwm_x))
-        pwm_y = max(0.0, min(1.0, pwm_y))
-        pwm_z = max(0.0, min(1.0, pwm_z))
+COILS = [DIR_Z1, DIR_Z2, DIR_Y3, DIR_Y4, DIR_X5, DIR_X6]  # calibration coil order
 
-        # Apply to both coils in each pair
-        DIR_X5.value = pwm_x
-        DIR_X6.value = pwm_x
+def set_coils(*duties):
+    # Signed duty [%] per coil -> value centred at 0.5 (0 current), clamped (safety)
+    for device, duty in zip(COILS, duties):
+        device.value = max(0.0, min(1.0, 0.5 + duty / 200))
 
-        DIR_Y3.value = pwm_y
-        DIR_Y4.value = pwm_y
+# Sinusoidal field samples [mT], converted to per-coil duty cycles through the
+# coil calibration once when loaded, then streamed on absolute 1 ms deadlines
+engine = waveforms.WaveformEngine(set_coils, UPDATE_RATE, calibration=coil_calibration.CALIBRATION)
+engine.load(waveforms.sinusoid(UPDATE_RATE, (f_x, f_y, f_z), (b_x, b_y, b_z), (phi_x, phi_y, phi_z)))
+if engine.saturated:
+    print(f"Warning: {engine.saturated} samples exceed the coils' range (clipped)")
 
-        DIR_Z1.value = pwm_z
-        DIR_Z2.value = pwm_z
-
-        time.sleep(0.001)  # 100 Hz update rate
+print("\nRunning PWM modulation. Press Ctrl+C to stop.\n")
+try:
+    engine.start()
+    while True:
+        time.sleep(0.1)
 
 except KeyboardInterrupt:
+    # Stopping resets every coil to 50% (0 current)
+    engine.stop()
     print("\nPWM modulation stopped.")
-
-    # Reset to 50% (0 current)
-    for device in [DIR_Z1, DIR_Z2, DIR_Y3, DIR_Y4, DIR_X5, DIR_X6]:
-        device.value = 0.5
+    print(f"Field updates: {engine.stats()}")
@@ -2,6 +2,7 @@ from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSlider, QPushButton, QComboBox, QFrame
 )
 from PyQt6.QtCore import Qt
+import os
 import sys
 import platform
 
@@ -10,6 +11,9 @@ is_rpi = platform.system() == "Linux"
 
 # GPIO Setup or Mock
 if is_rpi:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import pwm_backends  # MAS/pwm_backends.py
+    pwm_backends.configure_gpiozero()  # pin factory from MAS_PWM_BACKEND
     from gpiozero import PWMOutputDevice, OutputDevice
 else:
     print("Running in development mode (GPIO mocked)")
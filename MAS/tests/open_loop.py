@@ -1,17 +1,28 @@
 import cv2
 import sdl2
 import sdl2.ext
+import os
 import sys
 
 # Try Pi-only imports
 try:
     from picamera2 import Picamera2
     from libcamera import Transform
-    import RPi.GPIO as GPIO
     ON_PI = True
 except ImportError:
     ON_PI = False
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pwm_backends  # MAS/pwm_backends.py
+
+# Coils: whichever backend MAS_PWM_BACKEND selects loads (RPi.GPIO by default;
+# MAS_PWM_BACKEND=mock runs off the Pi and reports the output timing)
+try:
+    GPIO = pwm_backends.get_backend()
+    HAS_COILS = True
+except (ImportError, RuntimeError):
+    HAS_COILS = False
+
 # ---------------- Camera Abstraction ----------------
 class CameraBase:
     def read(self):
@@ -26,14 +37,15 @@ class MacCamera(CameraBase):
         self.cap = cv2.VideoCapture(0)
         if not self.cap.isOpened():
             raise RuntimeError("Could not open camera")
+        # Cache the geometry, it only changes if the capture is reconfigured
+        self._frame_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                            int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
     def read(self):
         return self.cap.read()
     def release(self):
         self.cap.release()
     def get_frame_size(self):
-        w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        return w, h
+        return self._frame_size
 
 class PiCamera(CameraBase):
     def __init__(self):
@@ -45,6 +57,8 @@ class PiCamera(CameraBase):
         )
         transform=Transform(vflip=1)
         self.picam2.start()
+        # Cache the configured geometry instead of capturing a frame to read it
+        self._frame_size = tuple(self.picam2.camera_configuration()["main"]["size"])
 
     def read(self):
         frame = self.picam2.capture_array()
@@ -55,12 +69,10 @@ class PiCamera(CameraBase):
         self.picam2.stop()
 
     def get_frame_size(self):
-        frame = self.picam2.capture_array()
-        h, w = frame.shape[:2]
-        return w, h
+        return self._frame_size
 
 # ---------------- PWM Setup ----------------
-if ON_PI:
+if HAS_COILS:
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
 
@@ -91,7 +103,7 @@ last_state = {"x_axis": 0, "y_axis": 0, "x_duty": 0, "y_duty": 0}
 def set_magnetic_field(x_val, y_val):
     """Update PWM duty cycles based on joystick axes [-32768..32767]."""
     global last_state
-    if not ON_PI:
+    if not HAS_COILS:
         return
 
     def scale(val):
@@ -228,9 +240,13 @@ try:
             break
 finally:
     camera.release()
-    if ON_PI:
+    if HAS_COILS:
         for pwm in [pwm_x_fwd, pwm_x_bwd, pwm_y_fwd, pwm_y_bwd]:
             pwm.stop()
         GPIO.cleanup()
+        if isinstance(GPIO, pwm_backends.MockBackend):
+            for pin, stats in GPIO.update_stats().items():
+                print(f"\nPin {pin}: {stats['updates']} updates, interval mean {stats['mean_ms']:.2f} "
+                      f"std {stats['std_ms']:.2f} p99 {stats['p99_ms']:.2f} max {stats['max_ms']:.2f} ms", end="")
     cv2.destroyAllWindows()
     print()  # move cursor to next line after logging
\ No newline at end of file
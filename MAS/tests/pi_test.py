@@ -1,5 +1,11 @@
+import os
+import sys
 from gpiozero import PWMOutputDevice, OutputDevice, Device
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pwm_backends  # MAS/pwm_backends.py
+pwm_backends.configure_gpiozero()  # pin factory from MAS_PWM_BACKEND
+
 
 x_pwm1 = PWMOutputDevice(17, frequency=1000)
 x_dir1 = OutputDevice(22)
@@ -0,0 +1,167 @@
+"""Automated PID gain search over the fitted plant models.
+
+    python3 plant.py                      # fit ../data/plant.json first
+    python3 tune.py --samples 50000
+    python3 tune.py --axes y --max-overshoot 2
+
+Random (kp, ki, kd, kaw) candidates are split into chunks and simulated on a
+process pool, one batch of episodes per chunk and step scenario (see
+plant.simulate_closed_loop). Each candidate is scored with the
+compute_performance metrics (metrics.step_metrics), worst case over the
+scenarios, and the non-dominated candidates over (settling time, overshoot,
+steady-state error, effort) form the Pareto front. The recommended gains are
+the fastest settling front member within the overshoot and error limits,
+printed in the form closed_loop.py uses.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import metrics
+import plant as pl
+
+# Search box: (low, high, log scale)
+GAIN_RANGES = {
+    "kp": (0.2, 40.0, True),
+    "ki": (0.0, 20.0, False),
+    "kd": (0.0, 2.0, False),
+    "kaw": (0.0, 5.0, False),
+}
+OBJECTIVES = ("settling_time", "overshoot", "ess", "effort")
+
+
+def scenarios(plant, margin=20, small_step=30):
+    """(x0, setpoint) step scenarios across the workspace of the plant."""
+    lo, hi = plant.limits
+    mid = (lo + hi) / 2
+    return [(lo + margin, mid), (hi - margin, mid), (mid, mid + small_step), (mid, mid - small_step)]
+
+
+def sample_gains(n, seed=0):
+    rng = np.random.default_rng(seed)
+    gains = {}
+    for name, (lo, hi, log_scale) in GAIN_RANGES.items():
+        if log_scale:
+            gains[name] = np.exp(rng.uniform(np.log(lo), np.log(hi), n))
+        else:
+            gains[name] = rng.uniform(lo, hi, n)
+    return gains
+
+
+def score(plant_dict, gains, duration=5.0, dt=1 / 30, noise=0.5, output_limits=(-60, 60)):
+    """Worst case metrics over the scenarios for a batch of gains ({name: (B,)}).
+    Runs in the worker processes, so the plant comes in as a dict."""
+    plant = pl.AxisPlant.from_dict(plant_dict)
+    worst = None
+    for i, (x0, setpoint) in enumerate(scenarios(plant)):
+        result = pl.simulate_closed_loop(plant, gains["kp"], gains["ki"], gains["kd"], kaw=gains["kaw"],
+                                         x0=x0, setpoint=setpoint, duration=duration, dt=dt,
+                                         output_limits=output_limits, noise=noise, seed=i)
+        m = metrics.step_metrics(result.time, result.pos, result.u, setpoint, x0=x0)
+        # Never settled counts as the whole run
+        m["settling_time"] = np.where(np.isnan(m["settling_time"]), 2 * duration, m["settling_time"])
+        if worst is None:
+            worst = m
+        else:
+            worst = {name: (worst[name] + m[name] if name == "effort" else np.maximum(worst[name], m[name]))
+                     for name in m}
+    worst["effort"] = worst["effort"] / len(scenarios(plant))
+    return worst
+
+
+def _score_chunk(job):
+    plant_dict, gains, kwargs = job
+    return score(plant_dict, gains, **kwargs)
+
+
+def pareto_front(costs):
+    """Indices of the non-dominated rows of costs (N, M), all minimised."""
+    order = np.lexsort(costs.T[::-1])     # by first objective, then the others
+    front = []
+    for i in order:
+        c = costs[i]
+        if front:
+            f = costs[front]
+            if np.any(np.all(f <= c, axis=1) & np.any(f < c, axis=1)):
+                continue
+        front.append(i)
+    return np.array(front, dtype=int)
+
+
+def search(plant, samples=20000, chunk=2000, workers=None, seed=0, **kwargs):
+    """Score random gains on a process pool. Returns (gains, metrics) as
+    dicts of (samples,) arrays."""
+    gains = sample_gains(samples, seed)
+    jobs = [(plant.to_dict(), {name: values[i:i + chunk] for name, values in gains.items()}, kwargs)
+            for i in range(0, samples, chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_score_chunk, jobs))
+    scores = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+    return gains, scores
+
+
+def recommend(gains, scores, front, max_overshoot=5.0, max_ess=2.0):
+    """Fastest settling front member within the overshoot/error limits (or the
+    one with the lowest overshoot if none is)."""
+    ok = front[(scores["overshoot"][front] <= max_overshoot) & (scores["ess"][front] <= max_ess)]
+    if len(ok):
+        best = ok[np.argmin(scores["settling_time"][ok])]
+    else:
+        best = front[np.argmin(scores["overshoot"][front])]
+    return {name: float(values[best]) for name, values in gains.items()}, \
+           {name: float(values[best]) for name, values in scores.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search PID gains over the fitted plant models")
+    parser.add_argument("--models", default="../data/plant.json", help="output of plant.py")
+    parser.add_argument("--axes", nargs="+", default=["x", "y"])
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=2000, help="candidates per worker task")
+    parser.add_argument("--workers", type=int, default=None, help="default: all cores")
+    parser.add_argument("--duration", type=float, default=5.0, help="simulated seconds per step")
+    parser.add_argument("--noise", type=float, default=0.5, help="tracker noise [px]")
+    parser.add_argument("--max-overshoot", type=float, default=5.0, help="[%%]")
+    parser.add_argument("--max-ess", type=float, default=2.0, help="[px]")
+    parser.add_argument("--out", default=time.strftime("../data/%Y%m%d_%Hh%Mm%Ss_tune.json"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.models):
+        raise SystemExit(f"{args.models} not found: run plant.py first")
+    plants = pl.load_models(args.models)
+
+    results, recommended = {}, {}
+    for axis in args.axes:
+        model = plants[axis]
+        start = time.perf_counter()
+        gains, scores = search(model, args.samples, args.chunk, args.workers,
+                               duration=args.duration, noise=args.noise)
+        costs = np.column_stack([scores[name] for name in OBJECTIVES])
+        front = pareto_front(costs)
+        best_gains, best_scores = recommend(gains, scores, front, args.max_overshoot, args.max_ess)
+        recommended[axis] = best_gains
+        print(f"{axis}: {args.samples} candidates in {time.perf_counter() - start:.1f} s, "
+              f"{len(front)} on the Pareto front")
+        print("    recommended " + "  ".join(f"{k} {v:.3f}" for k, v in best_gains.items()) +
+              f"  ->  Ts {best_scores['settling_time']:.2f} s  overshoot {best_scores['overshoot']:.1f} %  "
+              f"Ess {best_scores['ess']:.1f} px  effort {best_scores['effort']:.1f}")
+        results[axis] = {
+            "plant": model.to_dict(),
+            "recommended": {"gains": best_gains, "metrics": best_scores},
+            "front": [{"gains": {k: float(v[i]) for k, v in gains.items()},
+                       "metrics": {k: float(v[i]) for k, v in scores.items()}} for i in front],
+        }
+
+    if len(recommended) == 2 and set(recommended) == {"x", "y"}:
+        x, y = recommended["x"], recommended["y"]
+        print("closed_loop.py:")
+        print(f'    ctlr.VectorPID(("x", "y"), kp=({x["kp"]:.3f}, {y["kp"]:.3f}), '
+              f'ki=({x["ki"]:.3f}, {y["ki"]:.3f}), kd=({x["kd"]:.3f}, {y["kd"]:.3f}), '
+              f'kaw=({x["kaw"]:.3f}, {y["kaw"]:.3f}), output_limits=(-60, 60))')
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "axes": results}, f, indent=1)
+    print(f"Results written to {args.out}")
@@ -0,0 +1,273 @@
+"""Waveform generation for the coil drivers.
+
+PhaseAccumulator: sine / cosine from a lookup table indexed by a 32-bit
+phase accumulator (as in a DDS). Changing the frequency only changes the
+phase step, so the output stays phase-continuous.
+
+Ticker: absolute-deadline scheduling. Deadlines are start + k * period, so
+the update rate does not drift with the loop's own run time, and the
+lateness of every wake-up is recorded (profiling.StageTimer) as jitter.
+
+WaveformEngine: streams (N, 3) field sample buffers (sinusoid, rolling,
+tumbling, recorded) to the coils at a fixed rate, with double-buffered swaps.
+Given a coil_calibration.Calibration it converts each buffer to per-coil
+duty cycles once, when it is loaded, instead of on every sample.
+"""
+import threading
+import time
+import numpy as np
+import profiling
+
+PHASE_BITS = 32
+PHASE_MASK = (1 << PHASE_BITS) - 1
+
+
+class PhaseAccumulator:
+    """Quadrature oscillator at `rate` updates per second.
+
+    frequency [Hz] may be negative (reverses the rotation) and can be changed
+    at any time without a phase jump."""
+
+    def __init__(self, rate, frequency=0.0, table_bits=12):
+        self.rate = rate
+        self.table_bits = table_bits
+        size = 1 << table_bits
+        self.table = np.sin(2 * np.pi * np.arange(size) / size).tolist()   # list: fast scalar indexing
+        self._quarter = size // 4
+        self._index_mask = size - 1
+        self._shift = PHASE_BITS - table_bits
+        self.phase = 0
+        self.step = 0
+        self.frequency = frequency
+
+    @property
+    def frequency(self):
+        return self._frequency
+
+    @frequency.setter
+    def frequency(self, hz):
+        # Only the phase step changes: no jump in the output
+        self._frequency = hz
+        self.step = int(round(hz * (1 << PHASE_BITS) / self.rate)) & PHASE_MASK
+
+    def reset(self):
+        self.phase = 0
+
+    def value(self):
+        # (sin, cos) at the current phase
+        i = self.phase >> self._shift
+        return self.table[i], self.table[(i + self._quarter) & self._index_mask]
+
+    def advance(self, steps=1):
+        """Move the phase on by `steps` updates and return (sin, cos) there."""
+        self.phase = (self.phase + steps * self.step) & PHASE_MASK
+        return self.value()
+
+
+class Ticker:
+    """Sleep until absolute deadlines start + k * period.
+
+    wait() returns how many periods have passed since the previous call (1 when
+    on time, more after an overrun, so a phase accumulator can catch up instead
+    of slowing the waveform down). Lateness of every wake-up is kept in
+    self.timer under "lateness"; `overruns` counts missed deadlines."""
+
+    def __init__(self, period, timer=None):
+        self.period_ns = int(round(period * 1e9))
+        self.timer = timer if timer is not None else profiling.StageTimer(enabled=True)
+        self.overruns = 0
+        self.ticks = 0
+        self.restart()
+
+    def restart(self):
+        self._next = time.monotonic_ns() + self.period_ns
+
+    def wait(self):
+        remaining = self._next - time.monotonic_ns()
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+        now = time.monotonic_ns()
+        self.timer.record("lateness", now - self._next)
+
+        # Periods elapsed: 1 on time, more if deadlines were missed
+        periods = 1 + max(0, (now - self._next) // self.period_ns)
+        self.overruns += periods - 1
+        self.ticks += periods
+        self._next += periods * self.period_ns
+        return periods
+
+    def summary(self):
+        s = self.timer.stats().get("lateness")
+        if s is None:
+            return "no updates"
+        return (f"{self.ticks} updates, {self.overruns} missed | lateness p50 {s['p50']:.3f} "
+                f"p95 {s['p95']:.3f} p99 {s['p99']:.3f} max {s['max']:.3f} ms")
+
+
+# ---------------- Sample buffers ----------------
+# Field waveforms are (N, 3) float arrays of (bx, by, bz) samples at the
+# engine rate; they loop seamlessly when they hold whole periods.
+
+def _loop_duration(frequencies, candidates=(1.0, 10.0, 100.0)):
+    # Shortest buffer length [s] that holds whole cycles of every frequency
+    for duration in candidates:
+        if all(abs(f * duration - round(f * duration)) < 1e-9 for f in frequencies):
+            return duration
+    return candidates[-1]
+
+
+def sinusoid(rate, frequency, amplitude, phase=0.0, offset=0.0, duration=None):
+    """Per-axis sines: frequency [Hz], amplitude, phase [rad] and offset are
+    scalars or (bx, by, bz) triples. The buffer holds whole cycles of every
+    axis (frequencies are rounded to 1/duration; by default the duration is
+    the shortest of 1, 10 or 100 s that fits them exactly)."""
+    f, a, p, o = (np.broadcast_to(np.asarray(v, dtype=float), (3,)) for v in (frequency, amplitude, phase, offset))
+    duration = duration or _loop_duration(f)
+    f = np.round(f * duration) / duration
+    t = np.arange(int(round(rate * duration)))[:, None] / rate
+    return o + a * np.sin(2 * np.pi * f * t + p)
+
+
+def _vertical_plane(frequency, amplitude, heading, angle):
+    # Field rotating in the vertical plane that contains the heading
+    h = np.array([np.cos(heading), np.sin(heading), 0.0])
+    z = np.array([0.0, 0.0, 1.0])
+    sign = 1.0 if frequency >= 0 else -1.0
+    return amplitude * (np.cos(sign * angle)[:, None] * h + np.sin(sign * angle)[:, None] * z)
+
+
+def _period(rate, frequency):
+    # Phase [0, 1) of one period of |frequency| sampled at rate
+    n = max(2, int(round(rate / max(abs(frequency), 1e-6))))
+    return np.arange(n) / n
+
+
+def rolling(rate, frequency, amplitude, heading=0.0):
+    """One period of a field rotating at a constant rate in the vertical plane
+    along heading [rad, in the XY plane]: the agent rolls towards heading
+    (negative frequency rolls back)."""
+    p = _period(rate, frequency)
+    return _vertical_plane(frequency, amplitude, heading, 2 * np.pi * p)
+
+
+def tumbling(rate, frequency, amplitude, heading=0.0, dwell=0.6):
+    """Like rolling(), but the field lingers near horizontal and sweeps quickly
+    through vertical, so the agent flips end over end. dwell in [0, 1): 0 is
+    plain rolling, larger values dwell longer."""
+    p = _period(rate, frequency)
+    angle = 2 * np.pi * p - dwell / 2 * np.sin(4 * np.pi * p)
+    return _vertical_plane(frequency, amplitude, heading, angle)
+
+
+def recorded(samples, sample_rate, rate):
+    """A recorded (N, 3) field sequence at sample_rate, resampled to rate."""
+    samples = np.asarray(samples, dtype=float)
+    t_in = np.arange(len(samples)) / sample_rate
+    t_out = np.arange(int(len(samples) * rate / sample_rate)) / rate
+    return np.column_stack([np.interp(t_out, t_in, samples[:, k]) for k in range(3)])
+
+
+# ---------------- Streaming ----------------
+class WaveformEngine:
+    """Streams (N, 3) field buffers to output(bx, by, bz) at a fixed rate on
+    its own thread.
+
+    Double buffered: load() only stages the next buffer, and the streaming
+    thread swaps it in between two samples. Between looping buffers it keeps
+    the sample index (time since the buffer start), which keeps the phase
+    when only amplitudes / offsets change. Buffers loaded with period=True
+    hold exactly one period (rolling(), tumbling()); between two of those it
+    keeps the phase (fraction of the buffer) instead, so their frequency can
+    change without a jump. Changing a sinusoid() frequency does jump: the
+    per-axis phases of a multi-cycle buffer can't be carried over. A buffer
+    loaded with loop=False plays once; whatever is staged next follows
+    straight after it.
+
+    With a calibration (coil_calibration.Calibration), buffers are fields in
+    mT: load() maps the whole buffer through calibration.field_to_duty() in
+    one call and output gets the six clipped duty cycles [%] per sample
+    instead, in the calibration's coil order (Z1, Z2, Y3, Y4, X5, X6).
+
+    underruns: samples with nothing to play (output set to zero)
+    saturated: samples of the last loaded buffer the coils cannot reach
+    self.ticker: deadline timing, missed updates and jitter (see Ticker)
+    """
+
+    def __init__(self, output, rate=1000, calibration=None):
+        self.output = output
+        self.rate = rate
+        self.calibration = calibration
+        self._zero = (0.0,) * (3 if calibration is None else 6)
+        self.ticker = Ticker(1.0 / rate)
+        self.underruns = 0
+        self.saturated = 0
+        self._active = None     # (buffer, loop, period)
+        self._pending = None
+        self._index = 0
+        self._lock = threading.Lock()
+        self.running = False
+        self._thread = None
+
+    def load(self, buffer, loop=True, period=False):
+        buffer = np.ascontiguousarray(buffer, dtype=float)
+        if buffer.ndim != 2 or buffer.shape[1] != 3 or len(buffer) == 0:
+            raise ValueError("Waveform buffers must be non-empty (N, 3) arrays")
+        if self.calibration is not None:
+            # Whole buffer through the calibration at once: (N, 3) mT -> (N, 6) duty [%]
+            buffer, saturated = self.calibration.field_to_duty(buffer)
+            self.saturated = int(saturated.any(axis=1).sum())
+        with self._lock:
+            self._pending = (buffer.tolist(), loop, period and loop)   # lists: fast per-sample indexing
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self.output(*self._zero)
+
+    def stats(self):
+        return f"{self.ticker.summary()}, {self.underruns} underruns"
+
+    def _swap(self):
+        # Take the staged buffer (called with the lock held)
+        buffer, loop, period = self._pending
+        active = self._active
+        if active is not None and active[1] and loop:
+            if active[2] and period:
+                self._index = int(self._index * len(buffer) / len(active[0])) % len(buffer)
+            else:
+                self._index %= len(buffer)
+        else:
+            self._index = 0
+        self._active, self._pending = self._pending, None
+
+    def _run(self):
+        self.ticker.restart()
+        while self.running:
+            with self._lock:
+                if self._pending is not None and (self._active is None or self._active[1]
+                                                  or self._index >= len(self._active[0])):
+                    self._swap()
+                active = self._active
+
+            if active is None or (not active[1] and self._index >= len(active[0])):
+                self.underruns += 1
+                self.output(*self._zero)
+            else:
+                buffer, loop, _ = active
+                if loop:
+                    self._index %= len(buffer)
+                self.output(*buffer[min(self._index, len(buffer) - 1)])
+
+            steps = self.ticker.wait()
+            self._index += steps
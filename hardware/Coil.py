@@ -1,6 +1,12 @@
+import os
+import sys
 from gpiozero import PWMOutputDevice, OutputDevice, Device
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "MAS"))
+import pwm_backends  # MAS/pwm_backends.py
+pwm_backends.configure_gpiozero()  # pin factory from MAS_PWM_BACKEND
+
 class Coil:
     def __init__(self, dir1, pwm1, dir2, pwm2):
         self.mode = "Helmholtz"